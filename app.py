@@ -1,7 +1,9 @@
 import streamlit as st
-from utils.auth import initialize_auth_state, show_auth_page, show_user_info, show_woocommerce_orders
-from utils.database import get_user_usage, get_user_orders_summary
-from utils.woo_product_auth import get_user_product_access_level
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from utils.auth import initialize_auth_state, check_authentication, show_auth_page, show_user_info, show_woocommerce_orders
+from utils.database import cached_user_usage, cached_user_orders_summary, apply_cache_invalidations
 
 st.set_page_config(
     page_title="RentCast Property Analytics",
@@ -10,6 +12,89 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# Column layouts, built once instead of on every rerun
+_COLS_WELCOME = (2, 1, 1)
+_COLS_SUMMARY = (1, 1, 1, 1)
+_COLS_FEATURES = (1, 1, 1)
+
+def _render_cache_stats():
+    """Show entry counts and memory per cached function (enable with debug = true in secrets)."""
+    # Runtime stats are internal API, so a change there only hides this panel
+    try:
+        from collections.abc import Mapping
+        from streamlit.runtime import Runtime
+        from streamlit.runtime.stats import CacheStat
+
+        stats = Runtime.instance().stats_mgr.get_stats()
+        # A flat list up to Streamlit 1.52, grouped by metric family from 1.53
+        if isinstance(stats, Mapping):
+            stats = [stat for family in stats.values() for stat in family]
+
+        df = pd.DataFrame(
+            [(s.category_name, s.cache_name, s.byte_length) for s in stats if isinstance(s, CacheStat)],
+            columns=['Cache', 'Function', 'Bytes']
+        )
+        summary = df.groupby(['Cache', 'Function']).agg(Entries=('Bytes', 'size'), Bytes=('Bytes', 'sum')).reset_index()
+    except Exception as e:
+        st.caption(f"Cache stats unavailable: {e}")
+        return
+
+    with st.expander("🧮 Cache stats"):
+        st.dataframe(summary, hide_index=True, use_container_width=True)
+
+@st.fragment
+def _render_orders_summary(user_id):
+    """Render the WooCommerce orders summary as its own fragment."""
+    try:
+        orders_summary = cached_user_orders_summary(user_id)
+    except Exception as e:
+        st.warning(f"Failed to get orders summary: {e}")
+        return
+    if not orders_summary:
+        return
+    
+    st.subheader("🛒 WooCommerce Orders Summary")
+    
+    col1, col2, col3, col4 = st.columns(_COLS_SUMMARY)
+    
+    with col1:
+        st.metric("Total Orders", orders_summary['total_orders'])
+    
+    with col2:
+        st.metric("Total Spent", orders_summary['total_spent_str'])
+    
+    with col3:
+        st.metric("Completed", orders_summary['completed_orders'])
+    
+    with col4:
+        st.metric("Avg Order", orders_summary['avg_order_str'])
+    
+    # Show recent orders
+    recent_orders = orders_summary['recent_orders']
+    if recent_orders:
+        st.subheader("📦 Recent Orders")
+        recent_df = pd.DataFrame(
+            recent_orders[:3],
+            columns=['wc_order_id', 'status', 'date_created', 'product_count', 'payment_method', 'total_str']
+        )
+        recent_df['status'] = recent_df['status'].str.title()
+        recent_df['date_created'] = recent_df['date_created'].str.slice(0, 10)
+        st.dataframe(
+            recent_df,
+            column_config={
+                "wc_order_id": "Order ID",
+                "status": "Status",
+                "date_created": "Date",
+                "product_count": "Products",
+                "payment_method": "Payment",
+                "total_str": "Total"
+            },
+            hide_index=True,
+            use_container_width=True
+        )
+    
+    st.markdown("---")
+
 # Initialize authentication state
 initialize_auth_state()
 
@@ -18,30 +103,63 @@ st.title("🏡 RentCast Property Analytics")
 st.markdown("---")
 
 # Same authentication check as original
-if st.session_state.user is None:
+if not check_authentication():
     show_auth_page()
 else:
-    # Show user info in sidebar
-    show_user_info()
-    
     # Get user data (same structure as original)
     user_email = st.session_state.user.email
     user_id = st.session_state.user.id
-    display_name = getattr(st.session_state.user, 'display_name', user_email)
+    if not user_id:
+        st.error("Session missing user id, please log in again.")
+        st.stop()
+    
+    display_name = st.session_state.user.display_name or user_email
+    
+    # Drop cached orders/purchases that a WooCommerce webhook marked as changed
+    apply_cache_invalidations(user_id, user_email)
+    
+    # Fetch usage and orders summary concurrently; this also warms the
+    # cache read by the orders summary fragment below
+    ctx = get_script_run_ctx()
+    with ThreadPoolExecutor(max_workers=2, initializer=add_script_run_ctx, initargs=(None, ctx)) as executor:
+        usage_future = executor.submit(cached_user_usage, user_id, user_email)
+        summary_future = executor.submit(cached_user_orders_summary, user_id)
+    # A failed prefetch is not cached; the fragment below retries and reports it
+    summary_future.exception()
+    
+    # Computed once at login from the stored purchases
+    access_info = st.session_state.access_info
+    
+    # Show user info in sidebar
+    show_user_info()
+    
+    with st.sidebar:
+        if st.button("🔄 Refresh Data", use_container_width=True):
+            from utils.woocommerce_sync import fetch_user_orders
+            
+            # Only this user's entries; the orders table follows the orders' version
+            cached_user_usage.clear(user_id, user_email)
+            cached_user_orders_summary.clear(user_id)
+            fetch_user_orders.clear(user_id)
+            st.rerun()
+        
+        if st.secrets.get("debug", False):
+            _render_cache_stats()
     
     # Welcome message and quick stats
-    col1, col2, col3 = st.columns([2, 1, 1])
+    col1, col2, col3 = st.columns(_COLS_WELCOME)
     
     with col1:
         st.success(f"Welcome back, {display_name}!")
         
         # Show WooCommerce product access info
-        if hasattr(st.session_state.user, 'purchased_products'):
-            access_info = get_user_product_access_level(user_email)
+        if st.session_state.user.purchased_products:
             st.caption(f"🛒 Access Level: {access_info['access_level'].title()} ({access_info['product_count']} products owned)")
     
     with col2:
-        queries_used = get_user_usage(user_id, user_email)
+        queries_used, usage_error = usage_future.result()
+        if usage_error:
+            st.warning(usage_error)
         st.metric("Queries Used", f"{queries_used}/30")
     
     with col3:
@@ -51,12 +169,10 @@ else:
     st.markdown("---")
     
     # WooCommerce Product Access Summary
-    if hasattr(st.session_state.user, 'purchased_products') and st.session_state.user.purchased_products:
+    if st.session_state.user.purchased_products:
         st.subheader("🛒 Your Product Access")
         
-        access_info = get_user_product_access_level(user_email)
-        
-        col1, col2, col3, col4 = st.columns(4)
+        col1, col2, col3, col4 = st.columns(_COLS_SUMMARY)
         
         with col1:
             st.metric("Products Owned", access_info['product_count'])
@@ -73,25 +189,34 @@ else:
         
         # Show recent products
         st.subheader("📦 Recent Product Purchases")
-        recent_products = sorted(st.session_state.user.purchased_products, 
-                               key=lambda x: x.get('order_date', ''), reverse=True)[:3]
-        
-        for product in recent_products:
-            with st.expander(f"{product.get('name', 'Product')} - ${product.get('total', 0)}"):
-                col1, col2 = st.columns(2)
-                with col1:
-                    st.write(f"**Product ID:** {product.get('product_id')}")
-                    st.write(f"**Quantity:** {product.get('quantity', 1)}")
-                with col2:
-                    st.write(f"**Order ID:** {product.get('order_id')}")
-                    st.write(f"**Purchase Date:** {product.get('order_date', 'N/A')[:10]}")
+        recent_products = pd.DataFrame(
+            st.session_state.user.purchased_products[:3],
+            columns=['name', 'product_id', 'quantity', 'total', 'order_id', 'order_date']
+        )
+        recent_products['order_date'] = recent_products['order_date'].str.slice(0, 10)
+        st.dataframe(
+            recent_products,
+            column_config={
+                "name": "Product",
+                "product_id": "Product ID",
+                "quantity": "Quantity",
+                "total": "Total",
+                "order_id": "Order ID",
+                "order_date": "Purchase Date"
+            },
+            hide_index=True,
+            use_container_width=True
+        )
         
         st.markdown("---")
     
+    # WooCommerce orders summary (reruns scoped to the fragment)
+    _render_orders_summary(user_id)
+    
     # App overview (same as original)
     st.subheader("📋 Available Features")
     
-    col1, col2, col3 = st.columns(3)
+    col1, col2, col3 = st.columns(_COLS_FEATURES)
     
     with col1:
         st.markdown("""
@@ -120,8 +245,10 @@ else:
     st.markdown("---")
     
     # Show WooCommerce orders section
+    # The expander body runs even when collapsed, so only fetch on request
     with st.expander("🛒 View All WooCommerce Orders", expanded=False):
-        show_woocommerce_orders()
+        if st.toggle("Load my orders", key="load_orders"):
+            show_woocommerce_orders()
     
     st.markdown("---")
     st.info("💡 Use the sidebar navigation to access different features of the application.")
@@ -2,16 +2,21 @@
 -- Run these SQL commands in your Supabase SQL Editor
 
 -- 1. Create wp_users table to store WordPress user data
+-- One row per (lowercased) email, shared by WordPress and WooCommerce-only logins
 CREATE TABLE wp_users (
     id SERIAL PRIMARY KEY,
-    wp_user_id INTEGER UNIQUE NOT NULL,
-    email VARCHAR(255) NOT NULL,
+    wp_user_id INTEGER UNIQUE,
+    wc_customer_id INTEGER UNIQUE,
+    email VARCHAR(255) UNIQUE NOT NULL,
     username VARCHAR(100),
     display_name VARCHAR(255),
     roles JSONB,
     capabilities JSONB,
     wp_token TEXT,
     wp_token_expires VARCHAR(50),
+    purchased_products JSONB,
+    product_access BOOLEAN,
+    customer_data JSONB,
     last_login TIMESTAMP WITH TIME ZONE,
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
@@ -19,7 +24,7 @@ CREATE TABLE wp_users (
 -- 2. Create api_usage table to track API usage per WordPress user
 CREATE TABLE api_usage (
     id SERIAL PRIMARY KEY,
-    wp_user_id INTEGER REFERENCES wp_users(wp_user_id),
+    wp_user_id INTEGER UNIQUE REFERENCES wp_users(wp_user_id),
     email VARCHAR(255) NOT NULL,
     queries INTEGER DEFAULT 0,
     last_query TIMESTAMP WITH TIME ZONE,
@@ -49,6 +54,7 @@ CREATE TABLE wc_orders (
     currency VARCHAR(10),
     date_created TIMESTAMP WITH TIME ZONE,
     date_completed TIMESTAMP WITH TIME ZONE,
+    date_modified TIMESTAMP WITH TIME ZONE,
     product_count INTEGER,
     product_names JSONB,
     billing_email VARCHAR(255),
@@ -83,8 +89,10 @@ CREATE TABLE wc_products (
 );
 
 -- 6. Create user_sessions table for session management (optional)
+-- session_id is the SHA-256 of the opaque token kept in the app URL
 CREATE TABLE user_sessions (
     id SERIAL PRIMARY KEY,
+    session_id TEXT UNIQUE,
     user_id INTEGER REFERENCES wp_users(wp_user_id),
     last_login TIMESTAMP WITH TIME ZONE,
     user_data JSONB,
@@ -95,10 +103,15 @@ CREATE TABLE user_sessions (
 CREATE INDEX idx_wp_users_wp_user_id ON wp_users(wp_user_id);
 CREATE INDEX idx_wp_users_email ON wp_users(email);
 CREATE INDEX idx_api_usage_wp_user_id ON api_usage(wp_user_id);
-CREATE INDEX idx_query_history_wp_user_id ON query_history(wp_user_id);
-CREATE INDEX idx_wc_orders_wp_user_id ON wc_orders(wp_user_id);
+CREATE INDEX idx_query_history_wp_user_id_created ON query_history(wp_user_id, created_at DESC, id DESC);
+CREATE INDEX idx_wc_orders_wp_user_id_date ON wc_orders(wp_user_id, date_created DESC NULLS LAST);
 CREATE INDEX idx_wc_orders_wc_order_id ON wc_orders(wc_order_id);
+CREATE INDEX idx_wc_orders_wp_user_id_modified ON wc_orders(wp_user_id, date_modified DESC);
 CREATE INDEX idx_wc_products_wc_product_id ON wc_products(wc_product_id);
+CREATE INDEX idx_user_sessions_last_login ON user_sessions(last_login);
+-- GIN indexes for JSONB containment (@>) lookups
+CREATE INDEX idx_wp_users_purchased_products_gin ON wp_users USING GIN (purchased_products jsonb_path_ops);
+CREATE INDEX idx_wc_products_categories_gin ON wc_products USING GIN (categories jsonb_path_ops);
 
 -- 8. Enable Row Level Security (RLS) for better security
 ALTER TABLE wp_users ENABLE ROW LEVEL SECURITY;
@@ -133,3 +146,74 @@ GRANT SELECT ON wc_products TO authenticated;
 GRANT ALL ON ALL TABLES IN SCHEMA public TO service_role;
 GRANT ALL ON ALL SEQUENCES IN SCHEMA public TO service_role;
 
+-- 11. Atomic usage increment (single round-trip, no lost updates); creates
+-- the usage row on the first query
+DROP FUNCTION IF EXISTS increment_usage(INTEGER);
+CREATE OR REPLACE FUNCTION increment_usage(p_uid INTEGER, p_email VARCHAR)
+RETURNS INTEGER
+LANGUAGE sql
+AS $$
+    INSERT INTO api_usage (wp_user_id, email, queries, last_query)
+    VALUES (p_uid, p_email, 1, NOW())
+    ON CONFLICT (wp_user_id) DO UPDATE
+    SET queries = api_usage.queries + 1, last_query = NOW()
+    RETURNING queries;
+$$;
+
+-- 12. Orders summary aggregated in the database (totals + 5 most recent orders)
+CREATE OR REPLACE FUNCTION get_orders_summary(uid INTEGER)
+RETURNS JSON
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT json_build_object(
+        'total_orders', COUNT(*),
+        'total_spent', COALESCE(SUM(total), 0),
+        'completed_orders', COUNT(*) FILTER (WHERE status = 'completed'),
+        'recent_orders', (
+            SELECT COALESCE(json_agg(recent), '[]'::json)
+            FROM (
+                SELECT wc_order_id, status, date_created, product_count, payment_method, total
+                FROM wc_orders
+                WHERE wp_user_id = uid
+                ORDER BY date_created DESC NULLS LAST
+                LIMIT 5
+            ) recent
+        )
+    )
+    FROM wc_orders
+    WHERE wp_user_id = uid;
+$$;
+
+-- 13. Purge sessions older than 7 days, scheduled daily with pg_cron
+CREATE OR REPLACE FUNCTION purge_sessions()
+RETURNS VOID
+LANGUAGE sql
+AS $$
+    DELETE FROM user_sessions WHERE last_login < NOW() - INTERVAL '7 days';
+$$;
+
+-- Requires the pg_cron extension (enable it under Database > Extensions)
+CREATE EXTENSION IF NOT EXISTS pg_cron;
+SELECT cron.schedule('purge_sessions', '0 3 * * *', $$SELECT purge_sessions()$$);
+
+-- 14. Users who purchased a product (uses idx_wp_users_purchased_products_gin)
+CREATE OR REPLACE FUNCTION users_who_bought(p_product_id INTEGER)
+RETURNS TABLE (wp_user_id INTEGER, wc_customer_id INTEGER, email VARCHAR)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT u.wp_user_id, u.wc_customer_id, u.email
+    FROM wp_users u
+    WHERE u.purchased_products @> jsonb_build_array(jsonb_build_object('product_id', p_product_id));
+$$;
+
+-- 15. Cache invalidation markers, written by the wc-webhook Edge Function on
+-- WooCommerce order events and polled by the app to clear stale caches
+CREATE TABLE cache_invalidations (
+    email VARCHAR(255) PRIMARY KEY,
+    wc_customer_id INTEGER,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+ALTER TABLE cache_invalidations ENABLE ROW LEVEL SECURITY;
+CREATE POLICY "Service can manage cache invalidations" ON cache_invalidations FOR ALL USING (current_user = 'service_role');
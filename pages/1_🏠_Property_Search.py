@@ -7,7 +7,7 @@ import json
 import pandas as pd
 from utils.auth import initialize_auth_state
 from utils.rentcast_api import fetch_property_details, get_market_data
-from utils.database import get_user_usage
+from utils.database import cached_user_usage
 
 st.set_page_config(page_title="Property Search", page_icon="🏠")
 
@@ -27,7 +27,9 @@ with st.sidebar:
     st.subheader("Account Info")
     user_email = st.session_state.user.email
     user_id = st.session_state.user.id
-    queries_used = get_user_usage(user_id, user_email)
+    queries_used, usage_error = cached_user_usage(user_id, user_email)
+    if usage_error:
+        st.warning(usage_error)
     
     st.metric("Email", user_email)
     st.metric("Queries Used", f"{queries_used}/30")
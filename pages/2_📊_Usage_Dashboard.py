@@ -6,7 +6,7 @@ import plotly.express as px
 import pandas as pd
 from datetime import datetime, timedelta
 from utils.auth import initialize_auth_state
-from utils.database import get_user_usage, get_usage_history
+from utils.database import cached_user_usage, get_usage_history
 
 st.set_page_config(page_title="Usage Dashboard", page_icon="📊")
 
@@ -23,7 +23,9 @@ st.markdown("Monitor your API usage and account activity.")
 
 user_email = st.session_state.user.email
 user_id = st.session_state.user.id
-queries_used = get_user_usage(user_id, user_email)
+queries_used, usage_error = cached_user_usage(user_id, user_email)
+if usage_error:
+    st.warning(usage_error)
 
 # Usage overview
 st.subheader("🎯 Usage Overview")
@@ -0,0 +1,57 @@
+// WooCommerce order webhook (order.created / order.updated) that marks the
+// customer's cached orders and purchases as stale for apply_cache_invalidations.
+// Deploy with `supabase functions deploy wc-webhook --no-verify-jwt`, set the
+// WC_WEBHOOK_SECRET function secret, and point the WooCommerce webhooks here.
+import { createClient } from "jsr:@supabase/supabase-js@2";
+
+const supabase = createClient(Deno.env.get("SUPABASE_URL")!, Deno.env.get("SUPABASE_SERVICE_ROLE_KEY")!);
+const secretKey = await crypto.subtle.importKey(
+  "raw",
+  new TextEncoder().encode(Deno.env.get("WC_WEBHOOK_SECRET")!),
+  { name: "HMAC", hash: "SHA-256" },
+  false,
+  ["verify"],
+);
+
+// WooCommerce signs the raw body with HMAC-SHA256, base64 encoded.
+// crypto.subtle.verify compares the MACs in constant time.
+async function signatureMatches(body: string, signature: string | null): Promise<boolean> {
+  if (!signature) return false;
+  let mac: Uint8Array;
+  try {
+    mac = Uint8Array.from(atob(signature), (c) => c.charCodeAt(0));
+  } catch {
+    return false;
+  }
+  return await crypto.subtle.verify("HMAC", secretKey, mac, new TextEncoder().encode(body));
+}
+
+// The delivery ping sent when a webhook is saved is unsigned form data
+// holding only "webhook_id=<id>"
+function isDeliveryPing(body: string, signature: string | null): boolean {
+  if (signature) return false;
+  const form = new URLSearchParams(body);
+  return [...form.keys()].length === 1 && /^\d+$/.test(form.get("webhook_id") ?? "");
+}
+
+Deno.serve(async (req) => {
+  const body = await req.text();
+  const signature = req.headers.get("X-WC-Webhook-Signature");
+  if (isDeliveryPing(body, signature)) {
+    return new Response("pong", { status: 200 });
+  }
+  if (!(await signatureMatches(body, signature))) {
+    return new Response("invalid signature", { status: 401 });
+  }
+
+  const order = JSON.parse(body);
+  const email = order.billing?.email?.toLowerCase();
+  if (!email) return new Response("no email", { status: 200 });
+
+  const { error } = await supabase.from("cache_invalidations").upsert({
+    email,
+    wc_customer_id: order.customer_id || null,
+    updated_at: new Date().toISOString(),
+  });
+  return new Response(error ? error.message : "ok", { status: error ? 500 : 200 });
+});
@@ -0,0 +1,76 @@
+// WordPress JWT login + WooCommerce purchase lookup in one call.
+// Invoked by woo_product_login when st.secrets["supabase"]["login_function"]
+// is set; deploy with `supabase functions deploy woo-login` and set the
+// WP_URL, WC_CONSUMER_KEY and WC_CONSUMER_SECRET function secrets.
+
+const WP_URL = Deno.env.get("WP_URL")!;
+const WC_AUTH = "Basic " + btoa(`${Deno.env.get("WC_CONSUMER_KEY")}:${Deno.env.get("WC_CONSUMER_SECRET")}`);
+
+// Same projection as _PURCHASE_ORDER_FIELDS in utils/woo_product_auth.py
+const ORDER_FIELDS = "id,date_created,billing.email,line_items.product_id,line_items.name,line_items.quantity,line_items.total";
+
+const json = (body: unknown, status = 200) =>
+  new Response(JSON.stringify(body), { status, headers: { "Content-Type": "application/json" } });
+
+// Login outcomes come back as 200 with {user} or {error}; other statuses mean
+// the function itself failed and the app falls back to calling WordPress directly
+Deno.serve(async (req) => {
+  const { email, password } = await req.json();
+
+  const tokenResp = await fetch(`${WP_URL}/wp-json/jwt-auth/v1/token`, {
+    method: "POST",
+    body: new URLSearchParams({ username: email, password }),
+  });
+  if (!tokenResp.ok) return json({ error: "wordpress_auth_failed" });
+  const tokenData = await tokenResp.json();
+
+  const meResp = await fetch(`${WP_URL}/wp-json/wp/v2/users/me`, {
+    headers: { Authorization: `Bearer ${tokenData.token}` },
+  });
+  if (!meResp.ok) return json({ error: "user_info_failed" }, 502);
+  const wpUser = await meResp.json();
+  const userEmail: string = wpUser.email ?? email;
+
+  const params = new URLSearchParams({
+    search: userEmail,
+    status: "completed",
+    per_page: "100",
+    _fields: ORDER_FIELDS,
+  });
+  const ordersResp = await fetch(`${WP_URL}/wp-json/wc/v3/orders?${params}`, {
+    headers: { Authorization: WC_AUTH },
+  });
+  if (!ordersResp.ok) return json({ error: "orders_failed" }, 502);
+
+  // Unique products from exact billing-email matches, first order wins
+  const products = new Map();
+  for (const order of await ordersResp.json()) {
+    if ((order.billing?.email ?? "").toLowerCase() !== userEmail.toLowerCase()) continue;
+    for (const item of order.line_items ?? []) {
+      if (item.product_id && !products.has(item.product_id)) {
+        products.set(item.product_id, {
+          product_id: item.product_id,
+          name: item.name,
+          quantity: item.quantity ?? 1,
+          total: item.total ?? "0",
+          order_id: order.id,
+          order_date: order.date_created,
+        });
+      }
+    }
+  }
+  if (!products.size) return json({ error: "no_purchases" });
+
+  return json({
+    user: {
+      wp_user_id: wpUser.id,
+      email: userEmail,
+      username: wpUser.username ?? tokenData.user_nicename,
+      display_name: wpUser.name,
+      wp_token: tokenData.token,
+      purchased_products: [...products.values()],
+      roles: wpUser.roles ?? [],
+      capabilities: wpUser.capabilities ?? {},
+    },
+  });
+});
@@ -1,6 +1,15 @@
 import streamlit as st
-from utils.woo_product_auth import woo_product_login, get_user_product_access_level
-from utils.woocommerce_sync import get_wc_customer_orders, display_orders_analytics
+from dataclasses import dataclass
+
+@dataclass(frozen=True, slots=True)
+class User:
+    """Logged-in user stored in session state."""
+    id: int
+    email: str
+    username: str
+    display_name: str
+    purchased_products: tuple
+    product_access: bool
 
 def initialize_auth_state():
     """Initialize authentication-related session state variables."""
@@ -8,35 +17,104 @@ def initialize_auth_state():
         st.session_state.user = None
     if "access_token" not in st.session_state:
         st.session_state.access_token = None
+    
+    # Restore the login from the session id kept in the URL (e.g. after a refresh)
+    if st.session_state.user is None:
+        session_token = st.query_params.get("sid")
+        if session_token:
+            from utils.wordpress_auth import get_wp_user_by_session
+            user_data = get_wp_user_by_session(session_token)
+            if user_data and _validate_wp_token_cached(user_data.get('wp_token')):
+                _store_user(user_data)
+            else:
+                st.query_params.pop("sid", None)
+
+def _store_user(user_data):
+    """Store a logged-in user (login result or Supabase row) in session state."""
+    from utils.woo_product_auth import stable_user_id, get_user_product_access_level
+    
+    st.session_state.user = User(
+        id=user_data.get('wp_user_id') or user_data.get('wc_customer_id') or stable_user_id(user_data['email']),
+        email=user_data['email'],
+        username=user_data['username'],
+        display_name=user_data['display_name'],
+        # Newest purchases first, so renders can just slice
+        purchased_products=tuple(sorted(user_data.get('purchased_products') or (),
+                                        key=lambda p: p.get('order_date') or '', reverse=True)),
+        product_access=user_data.get('product_access', True)
+    )
+    st.session_state.access_token = user_data.get('wp_token') or 'woo_access'
+    # Lets check_product_access answer from the session without refetching
+    st.session_state.purchased_product_ids = {p['product_id'] for p in st.session_state.user.purchased_products}
+    
+    # Access level only depends on the purchases, so compute it once here
+    st.session_state.access_info = get_user_product_access_level(st.session_state.user.purchased_products)
 
 def login(email, password):
     """Handle user login using WooCommerce products."""
+    from utils.woo_product_auth import woo_product_login
+    
     try:
         user_data = woo_product_login(email, password)
         if user_data:
             # Store user data in session
-            st.session_state.user = type('User', (), {
-                'id': user_data.get('wp_user_id') or user_data.get('wc_customer_id') or hash(email),
-                'email': user_data['email'],
-                'username': user_data['username'],
-                'display_name': user_data['display_name'],
-                'purchased_products': user_data['purchased_products'],
-                'product_access': user_data['product_access']
-            })()
-            st.session_state.access_token = user_data.get('wp_token', 'woo_access')
+            _store_user(user_data)
+            # Keep an opaque, revocable session id (never the JWT) in the URL
+            # so a page refresh skips the login
+            if st.session_state.access_token != 'woo_access':
+                from utils.wordpress_auth import create_wp_session
+                session_token = create_wp_session(user_data.get('wp_user_id'))
+                if session_token:
+                    st.query_params["sid"] = session_token
             return user_data
         return None
     except Exception as e:
         st.error(f"Login failed: {e}")
         return None
 
+@st.cache_data(ttl=300, max_entries=1000, show_spinner=False)
+def _validate_wp_token_cached(token: str) -> bool:
+    """Validate a WordPress JWT at most once per 5 minutes."""
+    from utils.wordpress_auth import validate_wp_token
+    return validate_wp_token(token)
+
+def check_authentication():
+    """Check that the current session is logged in with a valid token."""
+    if st.session_state.user is None:
+        return False
+    
+    token = st.session_state.access_token
+    # WooCommerce customer logins have no WordPress JWT to validate
+    if token == 'woo_access':
+        return True
+    
+    if not _validate_wp_token_cached(token):
+        st.session_state.user = None
+        st.session_state.access_token = None
+        _end_url_session()
+        return False
+    return True
+
+def _end_url_session():
+    """Revoke the session id kept in the URL, if any, and drop it."""
+    session_token = st.query_params.pop("sid", None)
+    if session_token:
+        from utils.wordpress_auth import revoke_wp_session
+        revoke_wp_session(session_token)
+
 def logout():
     """Handle user logout."""
+    if st.session_state.access_token:
+        _validate_wp_token_cached.clear(st.session_state.access_token)
     st.session_state.user = None
     st.session_state.access_token = None
+    st.session_state.pop("purchased_product_ids", None)
+    st.session_state.pop("access_info", None)
+    _end_url_session()
     st.success("Logged out successfully!")
     st.rerun()
 
+@st.fragment
 def show_auth_page():
     """Display authentication page - same as original but with WooCommerce product auth."""
     st.subheader("🔐 Please sign in to continue")
@@ -48,89 +126,59 @@ def show_auth_page():
         login_button = st.form_submit_button("Login")
         
         if login_button and email and password:
-            user = login(email, password)
+            # One status for the WordPress, WooCommerce and Supabase steps
+            with st.status("Signing in...") as status:
+                user = login(email, password)
+                status.update(
+                    label="Signed in" if user else "Sign-in failed",
+                    state="complete" if user else "error",
+                    expanded=not user
+                )
             if user:
                 st.success("Logged in successfully!")
                 st.rerun()
 
 def show_user_info():
     """Display current user information and logout option."""
-    if st.session_state.user:
-        with st.sidebar:
-            st.markdown("### 👤 User Info")
-            st.write(f"**Name:** {st.session_state.user.get('display_name', 'N/A')}")
-            st.write(f"**Username:** {st.session_state.user.get('username', 'N/A')}")
-            st.write(f"**Email:** {st.session_state.user.get('email', 'N/A')}")
-            
-            if st.button("🔓 Logout", use_container_width=True):
-                logout()
-
-def show_woocommerce_orders():
-    """Display WooCommerce orders for the current user."""
-    if not st.session_state.user:
-        return
-    
-    wp_user_id = st.session_state.user.get('id')
-    if not wp_user_id:
-        st.warning("WordPress user ID not available")
-        return
-    
-    st.subheader("🛒 Your WooCommerce Orders")
-    
-    with st.spinner("Loading your orders..."):
-        orders = get_wc_customer_orders(wp_user_id)
-    
-    if orders:
-        display_orders_analytics(orders)
-        
-        # Detailed orders table
-        st.subheader("📋 Order Details")
-        
-        orders_data = []
-        for order in orders:
-            orders_data.append({
-                "Order ID": order['id'],
-                "Date": order.get('date_created', '').split('T')[0],
-                "Status": order.get('status', '').title(),
-                "Total": f"${order.get('total_float', 0):.2f}",
-                "Products": order.get('product_count', 0),
-                "Payment": order.get('payment_method_title', 'N/A')
-            })
-        
-        if orders_data:
-            st.dataframe(orders_data, use_container_width=True)
-    else:
-        st.info("No WooCommerce orders found for your account.")
-
-def require_auth(func):
-    """Decorator to require authentication for pages."""
-    def wrapper(*args, **kwargs):
-        if not check_authentication():
-            show_auth_page()
-            return
-        return func(*args, **kwargs)
-    return wrapper
-
     if st.session_state.user:
         with st.sidebar:
             st.markdown("### 👤 User Info")
             st.write(f"**Name:** {st.session_state.user.display_name}")
+            st.write(f"**Username:** {st.session_state.user.username}")
             st.write(f"**Email:** {st.session_state.user.email}")
             
             # Show product access info
-            if hasattr(st.session_state.user, 'purchased_products'):
+            if st.session_state.user.purchased_products:
                 product_count = len(st.session_state.user.purchased_products)
                 st.write(f"**Products Owned:** {product_count}")
                 
                 # Show access level
-                access_info = get_user_product_access_level(st.session_state.user.email)
-                st.write(f"**Access Level:** {access_info['access_level'].title()}")
+                st.write(f"**Access Level:** {st.session_state.access_info['access_level'].title()}")
             
             if st.button("🔓 Logout", use_container_width=True):
                 logout()
 
+def _orders_version(orders: list) -> int:
+    """Fingerprint of the fields shown in the orders table."""
+    return hash(tuple((o['id'], o.get('status'), o.get('total_float'), o.get('product_count')) for o in orders))
+
+# Same lifetime as fetch_user_orders, which supplies the orders
+@st.cache_resource(ttl=600, max_entries=128, show_spinner=False)
+def _orders_table(wp_user_id: int, orders_version: int, _orders: list):
+    """Build the order details table (keyed on the orders' version; shared, treat as read-only)."""
+    import pandas as pd
+    
+    df = pd.DataFrame(_orders, columns=['id', 'date_created', 'status', 'total_float', 'product_count', 'payment_method_title'])
+    df['date_created'] = pd.to_datetime(df['date_created'], format='ISO8601', errors='coerce')
+    df['status'] = df['status'].str.title()
+    df.columns = ['Order ID', 'Date', 'Status', 'Total', 'Products', 'Payment']
+    return df
+
+@st.fragment
 def show_woocommerce_orders():
     """Display WooCommerce orders for the current user."""
+    from utils.woocommerce_sync import fetch_user_orders, display_orders_analytics
+    
     if not st.session_state.user:
         return
     
@@ -141,8 +189,15 @@ def show_woocommerce_orders():
     
     st.subheader("🛒 Your WooCommerce Orders")
     
-    with st.spinner("Loading your orders..."):
-        orders = get_wc_customer_orders(user_id)
+    # One status block for the fetch, sync and pagination instead of nested spinners
+    with st.status("Loading your orders...") as status:
+        orders = fetch_user_orders(user_id)
+        if orders is None:
+            # Don't keep serving the failure from the cache
+            fetch_user_orders.clear(user_id)
+            status.update(label="Could not load your orders", state="error", expanded=True)
+            return
+        status.update(label=f"Loaded {len(orders)} orders", state="complete", expanded=False)
     
     if orders:
         display_orders_analytics(orders)
@@ -150,19 +205,15 @@ def show_woocommerce_orders():
         # Detailed orders table
         st.subheader("📋 Order Details")
         
-        orders_data = []
-        for order in orders:
-            orders_data.append({
-                "Order ID": order['id'],
-                "Date": order.get('date_created', '').split('T')[0],
-                "Status": order.get('status', '').title(),
-                "Total": f"${order.get('total_float', 0):.2f}",
-                "Products": order.get('product_count', 0),
-                "Payment": order.get('payment_method_title', 'N/A')
-            })
-        
-        if orders_data:
-            st.dataframe(orders_data, use_container_width=True)
+        st.dataframe(
+            _orders_table(user_id, _orders_version(orders), orders),
+            column_config={
+                "Total": st.column_config.NumberColumn(format="$%.2f"),
+                "Date": st.column_config.DateColumn()
+            },
+            hide_index=True,
+            use_container_width=True
+        )
     else:
         st.info("No WooCommerce orders found for your account.")
 
@@ -173,7 +224,7 @@ def get_user_client():
 def require_auth(func):
     """Decorator to require authentication for pages."""
     def wrapper(*args, **kwargs):
-        if st.session_state.user is None:
+        if not check_authentication():
             show_auth_page()
             return
         return func(*args, **kwargs)
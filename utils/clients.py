@@ -0,0 +1,123 @@
+import streamlit as st
+import functools
+import random
+import time
+import httpx
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from postgrest.exceptions import APIError
+from supabase import create_client
+
+# HTTP retries live only in the session adapters: idempotent methods only (never
+# the JWT login POST), and the last response is returned instead of raising
+_HTTP_RETRY = Retry(
+    total=3,
+    backoff_factor=0.3,
+    status_forcelist=[429, 502, 503, 504],
+    allowed_methods=frozenset(["GET", "HEAD"]),
+    raise_on_status=False
+)
+# WooCommerce reads are free to repeat, so also retry its sporadic 500s
+_WC_RETRY = _HTTP_RETRY.new(status_forcelist=[429, 500, 502, 503, 504])
+
+@st.cache_resource
+def get_http_session() -> requests.Session:
+    """Shared HTTP session with connection pooling (keep-alive across reruns, GET retries on 429/5xx)"""
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=10,
+        pool_maxsize=20,
+        max_retries=_HTTP_RETRY
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+@st.cache_resource
+def get_wc_session() -> requests.Session:
+    """Shared WooCommerce REST session (consumer key auth, pooling, retry on 429/5xx)"""
+    session = requests.Session()
+    session.auth = (
+        st.secrets["woocommerce"]["consumer_key"],
+        st.secrets["woocommerce"]["consumer_secret"]
+    )
+    adapter = HTTPAdapter(
+        pool_connections=10,
+        pool_maxsize=50,
+        max_retries=_WC_RETRY
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+@st.cache_resource
+def get_io_executor() -> ThreadPoolExecutor:
+    """Shared pool for fanning out HTTP/Supabase calls (bounds in-flight requests per process)"""
+    return ThreadPoolExecutor(max_workers=16, thread_name_prefix="io")
+
+class WCClient:
+    """WooCommerce REST endpoints with prebuilt URLs on the shared WooCommerce session"""
+
+    def __init__(self, base_url: str, session: requests.Session):
+        api_url = f"{base_url}/wp-json/wc/v3"
+        self.session = session
+        self.orders_url = f"{api_url}/orders"
+        self.customers_url = f"{api_url}/customers"
+        self.products_url = f"{api_url}/products"
+
+    def orders(self, params: dict = None, **kwargs) -> requests.Response:
+        return self.session.get(self.orders_url, params=params, **kwargs)
+
+    def customers(self, params: dict = None, **kwargs) -> requests.Response:
+        return self.session.get(self.customers_url, params=params, **kwargs)
+
+    def customer(self, customer_id: int, **kwargs) -> requests.Response:
+        return self.session.get(f"{self.customers_url}/{customer_id}", **kwargs)
+
+    def product(self, product_id: int, **kwargs) -> requests.Response:
+        return self.session.get(f"{self.products_url}/{product_id}", **kwargs)
+
+@st.cache_resource
+def get_wc_client() -> WCClient:
+    """Shared WooCommerce REST client (URLs and session built once per process)"""
+    return WCClient(st.secrets["wordpress"]["base_url"], get_wc_session())
+
+@st.cache_resource
+def get_supabase():
+    """Initialize Supabase client with caching"""
+    try:
+        SUPABASE_URL = st.secrets["supabase"]["url"]
+        SUPABASE_KEY = st.secrets["supabase"]["anon_key"]
+        return create_client(SUPABASE_URL, SUPABASE_KEY)
+    except Exception as e:
+        st.error(f"Failed to initialize Supabase: {e}")
+        return None
+
+# Postgres/PostgREST error codes worth retrying: connection loss, serialization
+# failures and deadlocks, resource exhaustion, timeouts, pool checkout errors
+_TRANSIENT_API_CODES = ("08", "40001", "40P01", "53", "57014", "PGRST000", "PGRST001", "PGRST002", "PGRST003")
+
+def _is_transient(error: Exception) -> bool:
+    """Whether a Supabase failure is worth retrying (not RLS, schema or bad requests)"""
+    if isinstance(error, httpx.TransportError):
+        return True
+    return str(getattr(error, 'code', '') or '').startswith(_TRANSIENT_API_CODES)
+
+def with_retry(fn=None, *, max_attempts: int = 4, base: float = 0.2):
+    """Retry transient Supabase failures with exponential backoff and full jitter"""
+    if fn is None:
+        return functools.partial(with_retry, max_attempts=max_attempts, base=base)
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        for attempt in range(max_attempts):
+            try:
+                return fn(*args, **kwargs)
+            except (APIError, httpx.TransportError) as e:
+                if attempt == max_attempts - 1 or not _is_transient(e):
+                    raise
+            time.sleep(random.uniform(0, base * 2 ** attempt))
+
+    return wrapper
@@ -1,43 +1,55 @@
 import streamlit as st
+import atexit
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from utils.clients import with_retry
 from utils.wordpress_auth import supabase
 
-def initialize_user_usage(wp_user_id: int, email: str):
+logger = logging.getLogger(__name__)
+
+def current_time():
+    """Timestamp for writes: the session's current_time, else the database's now()."""
+    return st.session_state.get('current_time') or 'now()'
+
+def initialize_user_usage(wp_user_id: int, email: str, created_at: str = None):
     """Initialize usage tracking for a WordPress user."""
     if not supabase:
         st.error("Supabase not available")
         return False
 
     try:
-        # Check if usage record already exists
-        existing = supabase.table("api_usage").select("*").eq("wp_user_id", wp_user_id).execute()
-        
-        if not existing.data:
-            # Create new usage record
-            supabase.table("api_usage").insert({
-                "wp_user_id": wp_user_id,
-                "email": email,
-                "queries": 0,
-                "created_at": st.session_state.get('current_time', 'now()')
-            }).execute()
-            return True
+        # Create the usage record unless one already exists (ON CONFLICT DO NOTHING)
+        supabase.table("api_usage").upsert({
+            "wp_user_id": wp_user_id,
+            "email": email,
+            "queries": 0,
+            "created_at": created_at or current_time()
+        }, on_conflict="wp_user_id", ignore_duplicates=True).execute()
         return True
     except Exception as e:
         st.error(f"Failed to initialize usage tracking: {e}")
         return False
 
+@with_retry
+def _fetch_user_usage(wp_user_id: int, email: str):
+    """Read the usage counter, creating the record if needed (raises on error)."""
+    response = supabase.table("api_usage").select("queries").eq("wp_user_id", wp_user_id).execute()
+    if response.data:
+        return response.data[0]["queries"]
+    # Create usage record if it doesn't exist
+    initialize_user_usage(wp_user_id, email)
+    return 0
+
 def get_user_usage(wp_user_id: int, email: str):
     """Get current API usage for a WordPress user."""
     if not supabase:
         return 0
 
     try:
-        response = supabase.table("api_usage").select("*").eq("wp_user_id", wp_user_id).execute()
-        if response.data:
-            return response.data[0]["queries"]
-        else:
-            # Create usage record if it doesn't exist
-            initialize_user_usage(wp_user_id, email)
-            return 0
+        return _fetch_user_usage(wp_user_id, email)
     except Exception as e:
         st.warning(f"Failed to get usage data: {e}")
         return 0
@@ -48,67 +60,150 @@ def increment_usage(wp_user_id: int, email: str):
         return False
 
     try:
-        current = get_user_usage(wp_user_id, email)
-        result = supabase.table("api_usage").update({
-            "queries": current + 1,
-            "last_query": st.session_state.get('current_time', 'now()')
-        }).eq("wp_user_id", wp_user_id).execute()
+        # Atomic server-side increment (see increment_usage in database_setup.sql)
+        result = supabase.rpc("increment_usage", {"p_uid": wp_user_id, "p_email": email}).execute()
         
+        # Drop the cached count so the next render shows the new value
+        cached_user_usage.clear(wp_user_id, email)
         return result.data is not None
     except Exception as e:
         st.error(f"Failed to increment usage: {e}")
         return False
 
-def get_usage_history(wp_user_id: int):
-    """Get usage history for dashboard."""
+def get_usage_history(wp_user_id: int, before: tuple = None, page_size: int = 50):
+    """Get usage history for dashboard, one page at a time.
+    
+    Pass the previous page's ``next_cursor`` as ``before`` to load older
+    entries (keyset pagination on (created_at, id), since batched log
+    writes share created_at values).
+    """
     if not supabase:
-        return []
+        return {"usage": None, "history": [], "next_cursor": None}
 
     try:
-        # Get usage record
-        usage_response = supabase.table("api_usage").select("*").eq("wp_user_id", wp_user_id).execute()
+        history_query = supabase.table("query_history").select("*").eq("wp_user_id", wp_user_id)
+        if before:
+            before_ts, before_id = before
+            history_query = history_query.or_(
+                f'created_at.lt."{before_ts}",and(created_at.eq."{before_ts}",id.lt.{int(before_id)})'
+            )
+        history_query = history_query.order("created_at", desc=True).order("id", desc=True).limit(page_size)
         
-        # Get query history if available (you might want to add a query_history table)
-        history_response = supabase.table("query_history").select("*").eq("wp_user_id", wp_user_id).order("created_at", desc=True).limit(50).execute()
+        # Usage record and query history are independent, so fetch them concurrently
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            usage_future = executor.submit(
+                supabase.table("api_usage").select("*").eq("wp_user_id", wp_user_id).execute
+            )
+            history_future = executor.submit(history_query.execute)
+        usage_response = usage_future.result()
+        history_response = history_future.result()
         
+        history = history_response.data if history_response.data else []
         return {
             "usage": usage_response.data[0] if usage_response.data else None,
-            "history": history_response.data if history_response.data else []
+            "history": history,
+            "next_cursor": (history[-1]["created_at"], history[-1]["id"]) if len(history) == page_size else None
         }
     except Exception as e:
         st.warning(f"Failed to get usage history: {e}")
-        return {"usage": None, "history": []}
+        return {"usage": None, "history": [], "next_cursor": None}
 
-def log_query(wp_user_id: int, email: str, query_type: str, query_data: dict):
-    """Log a query to the history table."""
-    if not supabase:
-        return False
+# query_history rows are buffered and written in bulk by a background thread
+_QUERY_LOG_BATCH_SIZE = 100
+_QUERY_LOG_FLUSH_SECONDS = 2.0
+_query_log_queue = queue.Queue()
+# Queued at exit to stop the writer after the rows ahead of it are written
+_QUERY_LOG_STOP = object()
 
+def _insert_query_log_rows(rows: list):
+    """Insert a batch of query_history rows in one request."""
     try:
-        supabase.table("query_history").insert({
-            "wp_user_id": wp_user_id,
-            "email": email,
-            "query_type": query_type,
-            "query_data": query_data,
-            "created_at": st.session_state.get('current_time', 'now()')
-        }).execute()
-        return True
+        with_retry(supabase.table("query_history").insert(rows).execute)()
     except Exception as e:
-        st.warning(f"Failed to log query: {e}")
+        # No Streamlit context in the writer thread, so log instead of st.warning
+        logger.warning("Failed to log %d queries: %s", len(rows), e)
+
+def _query_log_writer():
+    """Drain the query log queue, flushing every batch or every few seconds."""
+    while True:
+        row = _query_log_queue.get()
+        if row is _QUERY_LOG_STOP:
+            return
+        rows = [row]
+        stopping = False
+        deadline = time.monotonic() + _QUERY_LOG_FLUSH_SECONDS
+        while len(rows) < _QUERY_LOG_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                row = _query_log_queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if row is _QUERY_LOG_STOP:
+                stopping = True
+                break
+            rows.append(row)
+        _insert_query_log_rows(rows)
+        if stopping:
+            return
+
+def flush_query_log():
+    """Write out any buffered query_history rows."""
+    while True:
+        rows = []
+        while len(rows) < _QUERY_LOG_BATCH_SIZE:
+            try:
+                row = _query_log_queue.get_nowait()
+            except queue.Empty:
+                break
+            if row is not _QUERY_LOG_STOP:
+                rows.append(row)
+        if not rows:
+            return
+        _insert_query_log_rows(rows)
+
+def _stop_query_log_writer(writer: threading.Thread):
+    """At exit, let the writer finish its in-flight batch, then flush the rest."""
+    _query_log_queue.put(_QUERY_LOG_STOP)
+    writer.join(timeout=_QUERY_LOG_FLUSH_SECONDS + 10)
+    flush_query_log()
+
+@st.cache_resource
+def _start_query_log_writer():
+    """Start the background query log writer once per process."""
+    writer = threading.Thread(target=_query_log_writer, name="query-log-writer", daemon=True)
+    writer.start()
+    atexit.register(_stop_query_log_writer, writer)
+    return writer
+
+def log_query(wp_user_id: int, email: str, query_type: str, query_data: dict):
+    """Queue a query for the history table (written in batches)."""
+    if not supabase:
         return False
 
+    _start_query_log_writer()
+    _query_log_queue.put_nowait({
+        "wp_user_id": wp_user_id,
+        "email": email,
+        "query_type": query_type,
+        "query_data": query_data,
+        "created_at": current_time()
+    })
+    return True
+
 def check_usage_limit(wp_user_id: int, email: str, limit: int = 30):
     """Check if user has exceeded usage limit."""
     current_usage = get_user_usage(wp_user_id, email)
     return current_usage < limit
 
-def get_user_profile(wp_user_id: int):
-    """Get user profile from Supabase."""
+def get_user_profile(wp_user_id: int, columns: str = "*"):
+    """Get user profile from Supabase (pass ``columns`` to fetch only what you need)."""
     if not supabase:
         return None
 
     try:
-        response = supabase.table("wp_users").select("*").eq("wp_user_id", wp_user_id).execute()
+        response = supabase.table("wp_users").select(columns).eq("wp_user_id", wp_user_id).execute()
         return response.data[0] if response.data else None
     except Exception as e:
         st.warning(f"Failed to get user profile: {e}")
@@ -126,47 +221,117 @@ def update_user_profile(wp_user_id: int, profile_data: dict):
         st.error(f"Failed to update user profile: {e}")
         return False
 
+def _fetch_orders_summary(wp_user_id: int):
+    """Fetch and format the orders summary, None if the user has no orders (raises on errors)."""
+    # Aggregated server-side (see get_orders_summary in database_setup.sql)
+    response = supabase.rpc("get_orders_summary", {"uid": wp_user_id}).execute()
+    summary = response.data
+    
+    if summary and summary["total_orders"]:
+        total_orders = summary["total_orders"]
+        total_spent = float(summary["total_spent"])
+        recent_orders = summary["recent_orders"]
+        
+        # Pre-format money values so cached renders only look them up
+        for order in recent_orders:
+            order['total_str'] = f"${float(order.get('total') or 0):.2f}"
+        
+        return {
+            "total_orders": total_orders,
+            "total_spent": total_spent,
+            "completed_orders": summary["completed_orders"],
+            "recent_orders": recent_orders,
+            "total_spent_str": f"${total_spent:.2f}",
+            "avg_order_str": f"${total_spent / total_orders:.2f}"
+        }
+    return None
+
 def get_user_orders_summary(wp_user_id: int):
     """Get user's WooCommerce orders summary from Supabase."""
     if not supabase:
         return None
 
     try:
-        response = supabase.table("wc_orders").select("*").eq("wp_user_id", wp_user_id).execute()
-        
-        if response.data:
-            orders = response.data
-            total_orders = len(orders)
-            total_spent = sum(float(order.get('total', 0)) for order in orders)
-            completed_orders = len([o for o in orders if o.get('status') == 'completed'])
-            
-            return {
-                "total_orders": total_orders,
-                "total_spent": total_spent,
-                "completed_orders": completed_orders,
-                "recent_orders": sorted(orders, key=lambda x: x.get('date_created', ''), reverse=True)[:5]
-            }
-        return None
+        return _fetch_orders_summary(wp_user_id)
     except Exception as e:
         st.warning(f"Failed to get orders summary: {e}")
         return None
 
+@st.cache_data(ttl=60, max_entries=1000, show_spinner=False)
+def cached_user_usage(wp_user_id: int, email: str):
+    """Cached usage for render paths; returns (queries, error message or None)."""
+    if not supabase:
+        return 0, None
+
+    try:
+        return _fetch_user_usage(wp_user_id, email), None
+    except Exception as e:
+        return 0, f"Failed to get usage data: {e}"
+
+@st.cache_data(ttl=600, max_entries=1000, show_spinner=False)
+def cached_user_orders_summary(wp_user_id: int):
+    """Cached orders summary for render paths (keyed per user); raises on errors so they are not cached."""
+    if not supabase:
+        return None
+    return _fetch_orders_summary(wp_user_id)
+
+# Last invalidation marker applied per email (the caches are process-wide too)
+_applied_invalidations = {}
+
+@st.cache_data(ttl=30, max_entries=1000, show_spinner=False)
+def _invalidation_marker(email: str):
+    """Latest order-event timestamp for an email, polled at most every 30s."""
+    response = supabase.table("cache_invalidations").select("updated_at").eq("email", email.lower()).execute()
+    return response.data[0]["updated_at"] if response.data else None
+
+def apply_cache_invalidations(wp_user_id: int, email: str):
+    """Clear a user's order and purchase caches if a webhook reported a change."""
+    if not supabase:
+        return
+
+    try:
+        marker = _invalidation_marker(email)
+    except Exception as e:
+        st.warning(f"Failed to check for order updates: {e}")
+        return
+
+    if marker is None or _applied_invalidations.get(email) == marker:
+        return
+
+    from utils.woocommerce_sync import fetch_user_orders
+    from utils.woo_product_auth import purge_purchased_products_cache
+
+    fetch_user_orders.clear(wp_user_id)
+    cached_user_orders_summary.clear(wp_user_id)
+    purge_purchased_products_cache(email)
+    _applied_invalidations[email] = marker
+
 def cleanup_old_sessions():
-    """Clean up old user sessions (optional maintenance function)."""
+    """Clean up old user sessions now (pg_cron also runs this daily)."""
     if not supabase:
         return False
 
     try:
-        # Remove sessions older than 7 days
-        import datetime
-        cutoff_date = (datetime.datetime.now() - datetime.timedelta(days=7)).isoformat()
-        
-        supabase.table("user_sessions").delete().lt("last_login", cutoff_date).execute()
+        # Removes sessions older than 7 days (see purge_sessions in database_setup.sql)
+        supabase.rpc("purge_sessions").execute()
         return True
     except Exception as e:
         st.warning(f"Failed to cleanup old sessions: {e}")
         return False
 
+def get_users_who_bought(product_id: int):
+    """Get the users who purchased a product, matched server-side."""
+    if not supabase:
+        return []
+
+    try:
+        # JSONB containment on purchased_products (see users_who_bought in database_setup.sql)
+        response = supabase.rpc("users_who_bought", {"p_product_id": product_id}).execute()
+        return response.data or []
+    except Exception as e:
+        st.warning(f"Failed to get product buyers: {e}")
+        return []
+
 # Database schema creation functions (run once to set up tables)
 def create_database_tables():
     """Create necessary database tables in Supabase (run this once)."""
@@ -180,14 +345,18 @@ def create_database_tables():
         "wp_users": """
         CREATE TABLE wp_users (
             id SERIAL PRIMARY KEY,
-            wp_user_id INTEGER UNIQUE NOT NULL,
-            email VARCHAR(255) NOT NULL,
+            wp_user_id INTEGER UNIQUE,
+            wc_customer_id INTEGER UNIQUE,
+            email VARCHAR(255) UNIQUE NOT NULL,
             username VARCHAR(100),
             display_name VARCHAR(255),
             roles JSONB,
             capabilities JSONB,
             wp_token TEXT,
             wp_token_expires VARCHAR(50),
+            purchased_products JSONB,
+            product_access BOOLEAN,
+            customer_data JSONB,
             last_login TIMESTAMP WITH TIME ZONE,
             created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
         );
@@ -196,7 +365,7 @@ def create_database_tables():
         "api_usage": """
         CREATE TABLE api_usage (
             id SERIAL PRIMARY KEY,
-            wp_user_id INTEGER REFERENCES wp_users(wp_user_id),
+            wp_user_id INTEGER UNIQUE REFERENCES wp_users(wp_user_id),
             email VARCHAR(255) NOT NULL,
             queries INTEGER DEFAULT 0,
             last_query TIMESTAMP WITH TIME ZONE,
@@ -228,6 +397,7 @@ def create_database_tables():
             currency VARCHAR(10),
             date_created TIMESTAMP WITH TIME ZONE,
             date_completed TIMESTAMP WITH TIME ZONE,
+            date_modified TIMESTAMP WITH TIME ZONE,
             product_count INTEGER,
             product_names JSONB,
             billing_email VARCHAR(255),
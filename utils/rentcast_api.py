@@ -4,6 +4,7 @@
 
 import streamlit as st
 import requests
+from utils.clients import get_http_session
 from utils.database import get_user_usage, increment_usage
 
 # RentCast API configuration
@@ -37,7 +38,7 @@ def fetch_property_details(address, user_id, email):
     params = {"address": address}
 
     try:
-        response = requests.get(f"{RENTCAST_BASE_URL}/properties", headers=headers, params=params)
+        response = get_http_session().get(f"{RENTCAST_BASE_URL}/properties", headers=headers, params=params, timeout=15)
         if response.status_code == 200:
             increment_usage(user_id, email)
             return response.json()
@@ -65,7 +66,7 @@ def get_market_data(address, user_id, email):
     params = {"address": address}
 
     try:
-        response = requests.get(f"{RENTCAST_BASE_URL}/markets", headers=headers, params=params)
+        response = get_http_session().get(f"{RENTCAST_BASE_URL}/markets", headers=headers, params=params, timeout=15)
         if response.status_code == 200:
             increment_usage(user_id, email)
             return response.json()
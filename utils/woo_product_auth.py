@@ -1,7 +1,106 @@
 import streamlit as st
 import requests
-from typing import Optional, Dict, List
-from utils.wordpress_auth import supabase, wp_config
+import bisect
+import hashlib
+import httpx
+import ijson
+import logging
+import orjson
+from typing import Optional, Dict, Iterator, List
+from supabase import FunctionsError
+from utils.clients import get_http_session, get_wc_client
+from utils.wordpress_auth import supabase, wp_config, upsert_wp_user_row
+
+logger = logging.getLogger(__name__)
+
+# Product-based access levels as (min_products, level, permissions), sorted
+# by threshold (customize as needed)
+_ACCESS_TIERS = (
+    (1, "basic", ("property_search",)),
+    (3, "premium", ("property_search", "analytics", "export")),
+    (5, "enterprise", ("property_search", "analytics", "export", "api_access")),
+)
+_ACCESS_TIER_THRESHOLDS = tuple(tier[0] for tier in _ACCESS_TIERS)
+
+_PURCHASE_ORDER_FIELDS = "id,date_created,billing.email,line_items.product_id,line_items.name,line_items.quantity,line_items.total"
+
+def _iter_orders(resp) -> Iterator[Dict]:
+    """Parse a streamed orders response one order at a time"""
+    # Let urllib3 undo any gzip encoding before ijson reads the raw stream
+    resp.raw.decode_content = True
+    return ijson.items(resp.raw, 'item', use_float=True)
+
+def _get_customer_completed_orders(email: str) -> List[Dict]:
+    """Fallback: resolve the customer by email, then list their completed orders"""
+    customers_resp = get_wc_client().customers(
+        params={"email": email, "per_page": 1},
+        timeout=10
+    )
+
+    customers_resp.raise_for_status()
+    customers = orjson.loads(customers_resp.content)
+    if not customers:
+        return []
+
+    customer_id = customers[0]['id']
+
+    with get_wc_client().orders(
+        params={
+            "customer": customer_id,
+            "status": "completed",
+            "per_page": 100,
+            "_fields": _PURCHASE_ORDER_FIELDS
+        },
+        timeout=15,
+        stream=True
+    ) as orders_resp:
+        orders_resp.raise_for_status()
+        return list(_iter_orders(orders_resp))
+
+@st.cache_data(ttl=300, max_entries=1000, show_spinner=False)
+def _cached_purchased_products(email: str) -> List[Dict]:
+    """Products purchased by an email (raises on WooCommerce errors so they are not cached)"""
+    # Search completed orders by email in one request, projecting only the
+    # fields needed below and parsing orders as they stream in
+    with get_wc_client().orders(
+        params={
+            "search": email,
+            "status": "completed",
+            "per_page": 100,
+            "_fields": _PURCHASE_ORDER_FIELDS
+        },
+        timeout=15,
+        stream=True
+    ) as orders_resp:
+        if orders_resp.status_code == 200:
+            # search also matches other fields, so keep exact billing-email matches
+            orders = [
+                o for o in _iter_orders(orders_resp)
+                if (o.get('billing', {}).get('email') or '').lower() == email.lower()
+            ]
+        else:
+            orders = None
+
+    if orders is None:
+        orders = _get_customer_completed_orders(email)
+    
+    # Extract unique products from completed orders (first order wins)
+    purchased_products = {}
+    
+    for order in orders:
+        for item in order.get('line_items', ()):
+            product_id = item.get('product_id')
+            if product_id and product_id not in purchased_products:
+                purchased_products[product_id] = {
+                    'product_id': product_id,
+                    'name': item.get('name'),
+                    'quantity': item.get('quantity', 1),
+                    'total': item.get('total', '0'),
+                    'order_id': order.get('id'),
+                    'order_date': order.get('date_created')
+                }
+
+    return list(purchased_products.values())
 
 def get_user_purchased_products(email: str) -> List[Dict]:
     """Get products purchased by user email"""
@@ -9,68 +108,30 @@ def get_user_purchased_products(email: str) -> List[Dict]:
         return []
 
     try:
-        # First, find customer by email
-        customers_url = f"{wp_config['wp_url']}/wp-json/wc/v3/customers"
-        customers_resp = requests.get(
-            customers_url,
-            auth=(wp_config['wc_key'], wp_config['wc_secret']),
-            params={"email": email, "per_page": 1},
-            timeout=10
-        )
-
-        if customers_resp.status_code != 200 or not customers_resp.json():
-            return []
-
-        customer = customers_resp.json()[0]
-        customer_id = customer['id']
-
-        # Get customer orders
-        orders_url = f"{wp_config['wp_url']}/wp-json/wc/v3/orders"
-        orders_resp = requests.get(
-            orders_url,
-            auth=(wp_config['wc_key'], wp_config['wc_secret']),
-            params={
-                "customer": customer_id,
-                "status": "completed",
-                "per_page": 100
-            },
-            timeout=15
-        )
-
-        if orders_resp.status_code != 200:
-            return []
-
-        orders = orders_resp.json()
-        
-        # Extract unique products from completed orders
-        purchased_products = []
-        product_ids = set()
-        
-        for order in orders:
-            for item in order.get('line_items', []):
-                product_id = item.get('product_id')
-                if product_id and product_id not in product_ids:
-                    product_ids.add(product_id)
-                    purchased_products.append({
-                        'product_id': product_id,
-                        'name': item.get('name'),
-                        'quantity': item.get('quantity', 1),
-                        'total': item.get('total', '0'),
-                        'order_id': order.get('id'),
-                        'order_date': order.get('date_created')
-                    })
-
-        return purchased_products
-
+        return _cached_purchased_products(email)
     except Exception as e:
         st.error(f"Error fetching purchased products: {e}")
         return []
 
+def purge_purchased_products_cache(email: str):
+    """Drop cached purchase data for an email (e.g. after a new order webhook)"""
+    _cached_purchased_products.clear(email)
+
 def check_product_access(email: str, required_product_ids: List[int] = None) -> bool:
     """Check if user has purchased required products for access"""
-    purchased_products = get_user_purchased_products(email)
+    user = st.session_state.get('user')
+    is_session_user = user is not None and user.email == email
+
+    # Login already required a purchase, so "any purchase" checks need no lookup
+    if not required_product_ids and is_session_user and user.product_access:
+        return True
+
+    # Use the product IDs stored at login when checking the logged-in user
+    purchased_ids = st.session_state.get('purchased_product_ids')
+    if purchased_ids is None or not is_session_user:
+        purchased_ids = {p['product_id'] for p in get_user_purchased_products(email)}
     
-    if not purchased_products:
+    if not purchased_ids:
         return False
     
     # If no specific products required, any purchase grants access
@@ -78,8 +139,7 @@ def check_product_access(email: str, required_product_ids: List[int] = None) ->
         return True
     
     # Check if user has purchased any of the required products
-    purchased_ids = [p['product_id'] for p in purchased_products]
-    return any(pid in purchased_ids for pid in required_product_ids)
+    return not purchased_ids.isdisjoint(required_product_ids)
 
 def get_wc_product_details(product_id: int) -> Optional[Dict]:
     """Get WooCommerce product details"""
@@ -87,33 +147,67 @@ def get_wc_product_details(product_id: int) -> Optional[Dict]:
         return None
 
     try:
-        product_url = f"{wp_config['wp_url']}/wp-json/wc/v3/products/{product_id}"
-        resp = requests.get(
-            product_url,
-            auth=(wp_config['wc_key'], wp_config['wc_secret']),
+        resp = get_wc_client().product(
+            product_id,
             timeout=10
         )
 
         if resp.status_code == 200:
-            return resp.json()
+            return orjson.loads(resp.content)
         return None
 
-    except Exception as e:
+    except (requests.exceptions.RequestException, ValueError) as e:
         st.warning(f"Could not fetch product details: {e}")
         return None
 
+def _invoke_login_function(email: str, password: str) -> Optional[Dict]:
+    """Run the woo-login Edge Function if configured (None means log in directly)"""
+    function_name = st.secrets.get("supabase", {}).get("login_function")
+    if not supabase or not function_name:
+        return None
+
+    try:
+        result = supabase.functions.invoke(
+            function_name,
+            invoke_options={"body": {"email": email, "password": password}, "responseType": "json"}
+        )
+    except (FunctionsError, httpx.HTTPError) as e:
+        logger.warning("Login function %s failed, logging in directly: %s", function_name, e)
+        return None
+
+    if not isinstance(result, dict):
+        logger.warning("Login function %s returned %r, logging in directly", function_name, type(result))
+        return None
+    return result
+
 def woo_product_login(email: str, password: str) -> Optional[Dict]:
     """Login using WooCommerce product purchases + WordPress auth"""
     if not wp_config:
         st.error("WordPress configuration not available")
         return None
 
+    # The Edge Function (supabase/functions/woo-login) makes the WordPress and
+    # WooCommerce calls next to the API, replacing the round-trips below
+    result = _invoke_login_function(email, password)
+    if result:
+        if result.get("user"):
+            user_data = {**result["user"], "product_access": True}
+            if sync_woo_product_user(user_data):
+                return user_data
+            st.error("Failed to sync user data")
+            return None
+        if result.get("error") == "no_purchases":
+            st.error("🛒 No product purchases found. Please purchase a product to access the application.")
+            return None
+        if result.get("error") == "wordpress_auth_failed":
+            return woo_customer_login(email, password)
+
     # First authenticate with WordPress
     wp_url = f"{wp_config['wp_url']}/wp-json/jwt-auth/v1/token"
     
     try:
         # Try WordPress authentication first
-        wp_resp = requests.post(
+        wp_resp = get_http_session().post(
             wp_url,
             data={"username": email, "password": password},
             timeout=10
@@ -124,7 +218,7 @@ def woo_product_login(email: str, password: str) -> Optional[Dict]:
             
             # Get WordPress user details
             me_url = f"{wp_config['wp_url']}/wp-json/wp/v2/users/me"
-            me_resp = requests.get(
+            me_resp = get_http_session().get(
                 me_url,
                 headers={"Authorization": f"Bearer {wp_token_data['token']}"},
                 timeout=10
@@ -186,16 +280,14 @@ def woo_customer_login(email: str, password: str) -> Optional[Dict]:
             return None
 
         # Get customer details
-        customers_url = f"{wp_config['wp_url']}/wp-json/wc/v3/customers"
-        customers_resp = requests.get(
-            customers_url,
-            auth=(wp_config['wc_key'], wp_config['wc_secret']),
+        customers_resp = get_wc_client().customers(
             params={"email": email, "per_page": 1},
             timeout=10
         )
 
-        if customers_resp.status_code == 200 and customers_resp.json():
-            customer = customers_resp.json()[0]
+        customers = orjson.loads(customers_resp.content) if customers_resp.status_code == 200 else None
+        if customers:
+            customer = customers[0]
             
             # Create user data based on WooCommerce customer + products
             user_data = {
@@ -220,14 +312,23 @@ def woo_customer_login(email: str, password: str) -> Optional[Dict]:
         st.error(f"WooCommerce customer login error: {e}")
         return None
 
+def stable_user_id(email: str) -> int:
+    """Deterministic user ID for accounts with no WordPress/WooCommerce ID"""
+    digest = hashlib.blake2b(email.strip().lower().encode(), digest_size=4).digest()
+    # Fits the INTEGER id columns and stays above real WordPress IDs
+    return (1 << 30) | (int.from_bytes(digest, 'big') & ((1 << 30) - 1))
+
 def sync_woo_product_user(user_data: Dict) -> bool:
     """Sync WooCommerce product user to Supabase"""
     if not supabase:
         return False
 
+    from utils.database import initialize_user_usage, current_time
+    now = current_time()
+
     try:
-        # Prepare user data for Supabase
-        supabase_data = {
+        # Merged into the user's existing row by email (see upsert_wp_user_row)
+        stored = upsert_wp_user_row({
             "wp_user_id": user_data.get("wp_user_id"),
             "wc_customer_id": user_data.get("wc_customer_id"),
             "email": user_data["email"],
@@ -235,40 +336,21 @@ def sync_woo_product_user(user_data: Dict) -> bool:
             "display_name": user_data["display_name"],
             "purchased_products": user_data["purchased_products"],
             "product_access": user_data["product_access"],
-            "last_login": st.session_state.get('current_time', 'now()'),
-            "roles": user_data.get("roles", []),
-            "capabilities": user_data.get("capabilities", {}),
+            "last_login": now,
+            "roles": user_data.get("roles"),
+            "capabilities": user_data.get("capabilities"),
             "wp_token": user_data.get("wp_token"),
             "customer_data": user_data.get("customer_data")
-        }
+        }) or {}
 
-        # Check if user exists
-        identifier = user_data.get("wp_user_id") or user_data.get("wc_customer_id") or user_data["email"]
-        
-        if user_data.get("wp_user_id"):
-            existing = supabase.table("wp_users").select("*").eq("wp_user_id", user_data["wp_user_id"]).execute()
-        elif user_data.get("wc_customer_id"):
-            existing = supabase.table("wp_users").select("*").eq("wc_customer_id", user_data["wc_customer_id"]).execute()
-        else:
-            existing = supabase.table("wp_users").select("*").eq("email", user_data["email"]).execute()
-
-        if existing.data:
-            # Update existing user
-            if user_data.get("wp_user_id"):
-                supabase.table("wp_users").update(supabase_data).eq("wp_user_id", user_data["wp_user_id"]).execute()
-            elif user_data.get("wc_customer_id"):
-                supabase.table("wp_users").update(supabase_data).eq("wc_customer_id", user_data["wc_customer_id"]).execute()
-            else:
-                supabase.table("wp_users").update(supabase_data).eq("email", user_data["email"]).execute()
-        else:
-            # Insert new user
-            supabase_data["created_at"] = st.session_state.get('current_time', 'now()')
-            supabase.table("wp_users").insert(supabase_data).execute()
+        # Pick up identities the other login path stored for this email
+        for key in ("wp_user_id", "wc_customer_id"):
+            if not user_data.get(key) and stored.get(key):
+                user_data[key] = stored[key]
 
         # Initialize usage tracking
-        from utils.database import initialize_user_usage
-        user_id = user_data.get("wp_user_id") or user_data.get("wc_customer_id") or hash(user_data["email"])
-        initialize_user_usage(user_id, user_data["email"])
+        user_id = user_data.get("wp_user_id") or user_data.get("wc_customer_id") or stable_user_id(user_data["email"])
+        initialize_user_usage(user_id, user_data["email"], created_at=now)
 
         return True
 
@@ -276,37 +358,29 @@ def sync_woo_product_user(user_data: Dict) -> bool:
         st.error(f"Failed to sync WooCommerce product user: {e}")
         return False
 
-def get_user_product_access_level(email: str) -> Dict:
-    """Get user's product access level and permissions"""
-    purchased_products = get_user_purchased_products(email)
-    
+def get_user_product_access_level(purchased_products: List[Dict]) -> Dict:
+    """Get access level and permissions for an already-fetched purchase list"""
     if not purchased_products:
-        return {"access_level": "none", "products": [], "permissions": []}
-    
-    # Define product-based access levels (customize as needed)
-    access_levels = {
-        "basic": {"min_products": 1, "permissions": ["property_search"]},
-        "premium": {"min_products": 3, "permissions": ["property_search", "analytics", "export"]},
-        "enterprise": {"min_products": 5, "permissions": ["property_search", "analytics", "export", "api_access"]}
-    }
+        return {"access_level": "none", "products": [], "product_count": 0, "total_spent": 0.0, "permissions": []}
     
     product_count = len(purchased_products)
     total_spent = sum(float(p.get('total', 0)) for p in purchased_products)
     
-    # Determine access level
-    if product_count >= 5:
-        level = "enterprise"
-    elif product_count >= 3:
-        level = "premium"
-    elif product_count >= 1:
-        level = "basic"
+    # Highest tier whose minimum product count is met
+    tier = bisect.bisect_right(_ACCESS_TIER_THRESHOLDS, product_count) - 1
+    if tier >= 0:
+        _, level, permissions = _ACCESS_TIERS[tier]
     else:
-        level = "none"
+        level, permissions = "none", ()
     
     return {
         "access_level": level,
         "products": purchased_products,
         "product_count": product_count,
         "total_spent": total_spent,
-        "permissions": access_levels.get(level, {}).get("permissions", [])
+        "permissions": list(permissions)
     }
+
+def get_email_product_access_level(email: str) -> Dict:
+    """Get access level for an email by fetching its purchases (e.g. webhook recomputation)"""
+    return get_user_product_access_level(get_user_purchased_products(email))
@@ -1,96 +1,25 @@
 import streamlit as st
+import orjson
+import numpy as np
 import requests
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 from typing import Optional, Dict, List
+from utils.clients import get_http_session, get_io_executor, get_wc_client
 from utils.wordpress_auth import supabase, wp_config
 
-def get_user_purchased_products(email: str) -> List[Dict]:
-    """Get products purchased by user email"""
-    if not wp_config:
-        return []
-
-    try:
-        # First, find customer by email
-        customers_url = f"{wp_config['wp_url']}/wp-json/wc/v3/customers"
-        customers_resp = requests.get(
-            customers_url,
-            auth=(wp_config['wc_key'], wp_config['wc_secret']),
-            params={"email": email, "per_page": 1},
-            timeout=10
-        )
-
-        if customers_resp.status_code != 200 or not customers_resp.json():
-            return []
-
-        customer = customers_resp.json()[0]
-        customer_id = customer['id']
-
-        # Get customer orders
-        orders_url = f"{wp_config['wp_url']}/wp-json/wc/v3/orders"
-        orders_resp = requests.get(
-            orders_url,
-            auth=(wp_config['wc_key'], wp_config['wc_secret']),
-            params={
-                "customer": customer_id,
-                "status": "completed",
-                "per_page": 100
-            },
-            timeout=15
-        )
-
-        if orders_resp.status_code != 200:
-            return []
-
-        orders = orders_resp.json()
-        
-        # Extract unique products from completed orders
-        purchased_products = []
-        product_ids = set()
-        
-        for order in orders:
-            for item in order.get('line_items', []):
-                product_id = item.get('product_id')
-                if product_id and product_id not in product_ids:
-                    product_ids.add(product_id)
-                    purchased_products.append({
-                        'product_id': product_id,
-                        'name': item.get('name'),
-                        'quantity': item.get('quantity', 1),
-                        'total': item.get('total', '0'),
-                        'order_id': order.get('id'),
-                        'order_date': order.get('date_created')
-                    })
-
-        return purchased_products
-
-    except Exception as e:
-        st.error(f"Error fetching purchased products: {e}")
-        return []
-
-def check_product_access(email: str, required_product_ids: List[int] = None) -> bool:
-    """Check if user has purchased required products for access"""
-    purchased_products = get_user_purchased_products(email)
-    
-    if not purchased_products:
-        return False
-    
-    # If no specific products required, any purchase grants access
-    if not required_product_ids:
-        return True
-    
-    # Check if user has purchased any of the required products
-    purchased_ids = [p['product_id'] for p in purchased_products]
-    return any(pid in purchased_ids for pid in required_product_ids)
-
-def get_wc_product_details(product_id: int) -> Optional[Dict]:
-    """Get WooCommerce product details"""
+def get_wp_user_by_id(wp_user_id: int) -> Optional[Dict]:
+    """Get WordPress user details by ID"""
     if not wp_config:
         return None
 
     try:
-        product_url = f"{wp_config['wp_url']}/wp-json/wc/v3/products/{product_id}"
-        resp = requests.get(
-            product_url,
-            auth=(wp_config['wc_key'], wp_config['wc_secret']),
+        user_url = f"{wp_config['wp_url']}/wp-json/wp/v2/users/{wp_user_id}"
+        resp = get_http_session().get(
+            user_url,
+            auth=(wp_config['wp_user'], wp_config['wp_pass']),
+            params={"context": "edit"},
             timeout=10
         )
 
@@ -98,215 +27,318 @@ def get_wc_product_details(product_id: int) -> Optional[Dict]:
             return resp.json()
         return None
 
-    except Exception as e:
-        st.warning(f"Could not fetch product details: {e}")
+    except requests.exceptions.RequestException:
         return None
 
-def woo_product_login(email: str, password: str) -> Optional[Dict]:
-    """Login using WooCommerce product purchases + WordPress auth"""
+def _resolve_wc_customer_id(wp_user_id: int) -> Optional[int]:
+    """Resolve the WooCommerce customer ID for a WordPress user over the REST API"""
     if not wp_config:
-        st.error("WordPress configuration not available")
         return None
 
-    # First authenticate with WordPress
-    wp_url = f"{wp_config['wp_url']}/wp-json/jwt-auth/v1/token"
-    
     try:
-        # Try WordPress authentication first
-        wp_resp = requests.post(
-            wp_url,
-            data={"username": email, "password": password},
+        # Registered customers share their WordPress user ID; fetch the WordPress
+        # user at the same time in case the email fallback is needed
+        ctx = get_script_run_ctx()
+        with ThreadPoolExecutor(max_workers=2, initializer=add_script_run_ctx, initargs=(None, ctx)) as executor:
+            customer_future = executor.submit(get_wc_client().customer, wp_user_id, timeout=10)
+            wp_user_future = executor.submit(get_wp_user_by_id, wp_user_id)
+
+        customer_resp = customer_future.result()
+        if customer_resp.status_code == 200:
+            return orjson.loads(customer_resp.content).get('id')
+
+        # Fall back to looking the customer up by the WordPress email
+        wp_user = wp_user_future.result()
+        if not wp_user or not wp_user.get('email'):
+            return None
+
+        search_resp = get_wc_client().customers(
+            params={"email": wp_user['email'], "per_page": 1},
             timeout=10
         )
 
-        if wp_resp.status_code == 200:
-            wp_token_data = wp_resp.json()
-            
-            # Get WordPress user details
-            me_url = f"{wp_config['wp_url']}/wp-json/wp/v2/users/me"
-            me_resp = requests.get(
-                me_url,
-                headers={"Authorization": f"Bearer {wp_token_data['token']}"},
-                timeout=10
-            )
-
-            if me_resp.status_code == 200:
-                wp_user = me_resp.json()
-                user_email = wp_user.get('email', email)
-                
-                # Check WooCommerce product purchases
-                purchased_products = get_user_purchased_products(user_email)
-                
-                if not purchased_products:
-                    st.error("🛒 No product purchases found. Please purchase a product to access the application.")
-                    return None
-                
-                # Create user data with product information
-                user_data = {
-                    "wp_user_id": wp_user.get("id"),
-                    "email": user_email,
-                    "username": wp_user.get("username", wp_token_data.get("user_nicename")),
-                    "display_name": wp_user.get("name"),
-                    "wp_token": wp_token_data['token'],
-                    "purchased_products": purchased_products,
-                    "product_access": True,
-                    "roles": wp_user.get("roles", []),
-                    "capabilities": wp_user.get("capabilities", {})
-                }
-                
-                # Sync to Supabase with product info
-                sync_result = sync_woo_product_user(user_data)
-                if sync_result:
-                    return user_data
-                else:
-                    st.error("Failed to sync user data")
-                    return None
-            else:
-                st.error("Could not fetch WordPress user info")
-                return None
-        else:
-            # If WordPress auth fails, try WooCommerce customer login
-            return woo_customer_login(email, password)
+        customers = orjson.loads(search_resp.content) if search_resp.status_code == 200 else None
+        return customers[0]['id'] if customers else None
 
     except requests.exceptions.RequestException as e:
-        st.error(f"Connection error: {e}")
+        st.warning(f"Could not resolve WooCommerce customer: {e}")
         return None
 
-def woo_customer_login(email: str, password: str) -> Optional[Dict]:
-    """Alternative login using WooCommerce customer data"""
-    if not wp_config:
+@st.cache_data(ttl=3600, max_entries=1000, show_spinner=False)
+def _cached_wc_customer_id(wp_user_id: int) -> int:
+    """Customer ID stored in wp_users, else resolved and stored (raises LookupError if none)"""
+    if supabase:
+        stored = supabase.table("wp_users").select("wc_customer_id").eq("wp_user_id", wp_user_id).execute()
+        if stored.data and stored.data[0].get("wc_customer_id"):
+            return stored.data[0]["wc_customer_id"]
+
+    customer_id = _resolve_wc_customer_id(wp_user_id)
+    if not customer_id:
+        # Raising keeps the miss out of the cache, so a later signup is picked up
+        raise LookupError(wp_user_id)
+
+    if supabase:
+        supabase.table("wp_users").update({"wc_customer_id": customer_id}).eq("wp_user_id", wp_user_id).execute()
+    return customer_id
+
+def get_wc_customer_id_from_wp_user(wp_user_id: int) -> Optional[int]:
+    """Resolve the WooCommerce customer ID for a WordPress user"""
+    try:
+        return _cached_wc_customer_id(wp_user_id)
+    except LookupError:
         return None
+    except Exception as e:
+        st.warning(f"Could not use the stored WooCommerce customer ID: {e}")
+        return _resolve_wc_customer_id(wp_user_id)
+
+def enrich_order_data(order: Dict) -> Dict:
+    """Add derived fields used by the dashboard to a WooCommerce order"""
+    line_items = order.get('line_items', [])
+
+    order['total_float'] = float(order.get('total') or 0)
+    order['product_count'] = sum(item.get('quantity', 0) for item in line_items)
+    order['product_names'] = [item.get('name') for item in line_items]
+
+    return order
+
+_ORDER_UPSERT_CHUNK = 500
+
+def build_order_row(order: Dict, wp_user_id: int, synced_at: str) -> Dict:
+    """Map an enriched WooCommerce order to a wc_orders row"""
+    shipping_lines = order.get('shipping_lines', [])
+    return {
+        "wc_order_id": order['id'],
+        "wp_user_id": wp_user_id,
+        "wc_customer_id": order.get('customer_id'),
+        "status": order.get('status'),
+        "total": order['total_float'],
+        "tax_total": float(order.get('total_tax') or 0),
+        "currency": order.get('currency'),
+        "date_created": order.get('date_created'),
+        "date_completed": order.get('date_completed'),
+        "date_modified": order.get('date_modified_gmt'),
+        "product_count": order['product_count'],
+        "product_names": order['product_names'],
+        "billing_email": order.get('billing', {}).get('email'),
+        "billing_phone": order.get('billing', {}).get('phone'),
+        "shipping_method": shipping_lines[0].get('method_title') if shipping_lines else None,
+        "payment_method": order.get('payment_method_title'),
+        "synced_at": synced_at
+    }
+
+def _upsert_order_rows(rows: List[Dict]):
+    """Upsert one chunk of wc_orders rows"""
+    supabase.table("wc_orders").upsert(rows, on_conflict="wc_order_id").execute()
+
+def sync_orders_to_supabase(orders: List[Dict], wp_user_id: int) -> bool:
+    """Sync enriched WooCommerce orders to Supabase in bulk upserts"""
+    if not supabase or not orders:
+        return False
 
     try:
-        # Check if customer exists with purchases
-        purchased_products = get_user_purchased_products(email)
-        
-        if not purchased_products:
-            st.error("🛒 No product purchases found for this email. Please purchase a product to access the application.")
-            return None
+        # One timestamp for the whole batch
+        synced_at = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        rows = [build_order_row(order, wp_user_id, synced_at) for order in orders]
+
+        # Large histories go up as concurrent chunks instead of one huge request
+        chunks = [rows[i:i + _ORDER_UPSERT_CHUNK] for i in range(0, len(rows), _ORDER_UPSERT_CHUNK)]
+        if len(chunks) == 1:
+            _upsert_order_rows(rows)
+        else:
+            list(get_io_executor().map(_upsert_order_rows, chunks))
 
-        # Get customer details
-        customers_url = f"{wp_config['wp_url']}/wp-json/wc/v3/customers"
-        customers_resp = requests.get(
-            customers_url,
-            auth=(wp_config['wc_key'], wp_config['wc_secret']),
-            params={"email": email, "per_page": 1},
-            timeout=10
+        # wc_orders changed, so drop the user's cached Supabase summary
+        from utils.database import cached_user_orders_summary
+        cached_user_orders_summary.clear(wp_user_id)
+        return True
+
+    except Exception as e:
+        st.warning(f"Failed to sync {len(orders)} orders: {e}")
+        return False
+
+def _fetch_wc_orders(params: Dict) -> Optional[List[Dict]]:
+    """Fetch every page of a WooCommerce orders query (None if the API refuses it)"""
+    wc = get_wc_client()
+    orders_resp = wc.orders(params, timeout=15)
+
+    if orders_resp.status_code != 200:
+        st.warning(f"Could not fetch orders (status {orders_resp.status_code})")
+        return None
+
+    raw_orders = orjson.loads(orders_resp.content)
+
+    # Fetch any remaining pages concurrently
+    total_pages = int(orders_resp.headers.get("X-WP-TotalPages", "1"))
+    if total_pages > 1:
+        page_resps = get_io_executor().map(
+            lambda page: wc.orders({**params, "page": page}, timeout=15),
+            range(2, total_pages + 1)
         )
+        for page_resp in page_resps:
+            page_resp.raise_for_status()
+            raw_orders.extend(orjson.loads(page_resp.content))
+
+    return raw_orders
 
-        if customers_resp.status_code == 200 and customers_resp.json():
-            customer = customers_resp.json()[0]
-            
-            # Create user data based on WooCommerce customer + products
-            user_data = {
-                "wc_customer_id": customer['id'],
-                "email": email,
-                "username": customer.get('username', email.split('@')[0]),
-                "display_name": f"{customer.get('first_name', '')} {customer.get('last_name', '')}".strip() or email,
-                "purchased_products": purchased_products,
-                "product_access": True,
-                "customer_data": customer
-            }
-            
-            # Sync to Supabase
-            sync_result = sync_woo_product_user(user_data)
-            if sync_result:
-                return user_data
-        
-        st.error("Customer authentication failed")
+def _last_synced_modified(wp_user_id: int) -> Optional[str]:
+    """Latest WooCommerce modification time (GMT) among the user's synced orders"""
+    if not supabase:
         return None
 
+    try:
+        result = supabase.table("wc_orders").select("date_modified").eq("wp_user_id", wp_user_id).not_.is_(
+            "date_modified", "null"
+        ).order("date_modified", desc=True).limit(1).execute()
+        # Drop the "+00:00" Postgres adds; the value is already GMT
+        return result.data[0]["date_modified"][:19] if result.data else None
     except Exception as e:
-        st.error(f"WooCommerce customer login error: {e}")
+        st.warning(f"Could not read order sync state: {e}")
         return None
 
-def sync_woo_product_user(user_data: Dict) -> bool:
-    """Sync WooCommerce product user to Supabase"""
-    if not supabase:
-        return False
+def _stored_orders(wp_user_id: int) -> List[Dict]:
+    """Synced orders from Supabase in the shape of enriched WooCommerce orders (raises on error)"""
+    result = supabase.table("wc_orders").select(
+        "wc_order_id, status, total, date_created, product_count, product_names, payment_method"
+    ).eq("wp_user_id", wp_user_id).order("date_created", desc=True).execute()
+
+    return [
+        {
+            "id": row["wc_order_id"],
+            "status": row["status"],
+            "total_float": float(row["total"] or 0),
+            # Stored from WooCommerce's site-local value; drop the "+00:00" Postgres adds
+            "date_created": row["date_created"][:19] if row["date_created"] else None,
+            "product_count": row["product_count"],
+            "product_names": row["product_names"],
+            "payment_method_title": row["payment_method"]
+        }
+        for row in result.data
+    ]
+
+# Keeps in.(...) filters well inside URL length limits
+_ORDER_DELETE_CHUNK = 200
+# PostgREST caps rows per response (max-rows, 1000 on Supabase)
+_STORED_ID_PAGE = 1000
+
+def _delete_stored_orders(wp_user_id: int, order_ids: List[int]):
+    """Delete a user's synced orders by WooCommerce order ID, a chunk per request"""
+    for i in range(0, len(order_ids), _ORDER_DELETE_CHUNK):
+        supabase.table("wc_orders").delete().eq("wp_user_id", wp_user_id).in_(
+            "wc_order_id", order_ids[i:i + _ORDER_DELETE_CHUNK]
+        ).execute()
+
+def _stored_order_ids(wp_user_id: int) -> set:
+    """WooCommerce order IDs synced for a user (raises on error)"""
+    order_ids = set()
+    start = 0
+    while True:
+        result = supabase.table("wc_orders").select("wc_order_id").eq("wp_user_id", wp_user_id).order(
+            "wc_order_id"
+        ).range(start, start + _STORED_ID_PAGE - 1).execute()
+        order_ids.update(row["wc_order_id"] for row in result.data)
+        if len(result.data) < _STORED_ID_PAGE:
+            return order_ids
+        start += _STORED_ID_PAGE
+
+def _remove_trashed_orders(params: Dict, wp_user_id: int):
+    """Delete synced orders that were trashed in WooCommerce since the last sync"""
+    # Deltas only list live statuses, so ask for trashed orders separately.
+    # Orders deleted permanently never show up in a delta; the full fetch
+    # fallback prunes those (see _prune_stored_orders).
+    trashed = _fetch_wc_orders({**params, "status": "trash", "_fields": "id"})
+    if trashed:
+        _delete_stored_orders(wp_user_id, [order['id'] for order in trashed])
+
+def _prune_stored_orders(wp_user_id: int, live_order_ids: List[int]):
+    """Delete a user's synced orders that a full fetch no longer returned"""
+    try:
+        # Diff here rather than sending every live ID in a not.in.(...) URL
+        removed = _stored_order_ids(wp_user_id).difference(live_order_ids)
+        _delete_stored_orders(wp_user_id, sorted(removed))
+    except Exception as e:
+        st.warning(f"Could not prune removed orders: {e}")
+
+def get_wc_customer_orders(wp_user_id: int) -> Optional[List[Dict]]:
+    """Get WooCommerce orders for a WordPress user, syncing changes to Supabase (None if the fetch failed)"""
+    if not wp_config:
+        return None
+
+    customer_id = get_wc_customer_id_from_wp_user(wp_user_id)
+    if not customer_id:
+        return []
 
     try:
-        # Prepare user data for Supabase
-        supabase_data = {
-            "wp_user_id": user_data.get("wp_user_id"),
-            "wc_customer_id": user_data.get("wc_customer_id"),
-            "email": user_data["email"],
-            "username": user_data["username"],
-            "display_name": user_data["display_name"],
-            "purchased_products": user_data["purchased_products"],
-            "product_access": user_data["product_access"],
-            "last_login": st.session_state.get('current_time', 'now()'),
-            "roles": user_data.get("roles", []),
-            "capabilities": user_data.get("capabilities", {}),
-            "wp_token": user_data.get("wp_token"),
-            "customer_data": user_data.get("customer_data")
-        }
+        params = {"customer": customer_id, "per_page": 100}
 
-        # Check if user exists
-        identifier = user_data.get("wp_user_id") or user_data.get("wc_customer_id") or user_data["email"]
-        
-        if user_data.get("wp_user_id"):
-            existing = supabase.table("wp_users").select("*").eq("wp_user_id", user_data["wp_user_id"]).execute()
-        elif user_data.get("wc_customer_id"):
-            existing = supabase.table("wp_users").select("*").eq("wc_customer_id", user_data["wc_customer_id"]).execute()
-        else:
-            existing = supabase.table("wp_users").select("*").eq("email", user_data["email"]).execute()
-
-        if existing.data:
-            # Update existing user
-            if user_data.get("wp_user_id"):
-                supabase.table("wp_users").update(supabase_data).eq("wp_user_id", user_data["wp_user_id"]).execute()
-            elif user_data.get("wc_customer_id"):
-                supabase.table("wp_users").update(supabase_data).eq("wc_customer_id", user_data["wc_customer_id"]).execute()
-            else:
-                supabase.table("wp_users").update(supabase_data).eq("email", user_data["email"]).execute()
-        else:
-            # Insert new user
-            supabase_data["created_at"] = st.session_state.get('current_time', 'now()')
-            supabase.table("wp_users").insert(supabase_data).execute()
+        # After the first sync, only pull orders changed since the last one
+        last_modified = _last_synced_modified(wp_user_id)
+        if last_modified:
+            params.update({"modified_after": last_modified, "dates_are_gmt": "true"})
 
-        # Initialize usage tracking
-        from utils.database import initialize_user_usage
-        user_id = user_data.get("wp_user_id") or user_data.get("wc_customer_id") or hash(user_data["email"])
-        initialize_user_usage(user_id, user_data["email"])
+        raw_orders = _fetch_wc_orders(params)
+        if raw_orders is None:
+            return None
 
-        return True
+        orders = [enrich_order_data(order) for order in raw_orders]
+        synced = sync_orders_to_supabase(orders, wp_user_id) if orders else True
+
+        if not last_modified:
+            return orders
+
+        # Serve the full list from Supabase, which now includes the changes
+        try:
+            if not synced:
+                raise RuntimeError("order changes were not synced")
+            _remove_trashed_orders(params, wp_user_id)
+            return _stored_orders(wp_user_id)
+        except Exception as e:
+            st.warning(f"Falling back to a full order fetch: {e}")
+            del params["modified_after"], params["dates_are_gmt"]
+            raw_orders = _fetch_wc_orders(params)
+            if raw_orders is None:
+                return None
+            orders = [enrich_order_data(order) for order in raw_orders]
+            # Bring Supabase fully up to date so the next delta starts from here
+            if sync_orders_to_supabase(orders, wp_user_id):
+                _prune_stored_orders(wp_user_id, [order['id'] for order in orders])
+            return orders
 
-    except Exception as e:
-        st.error(f"Failed to sync WooCommerce product user: {e}")
-        return False
+    except requests.exceptions.RequestException as e:
+        st.error(f"Error fetching WooCommerce orders: {e}")
+        return None
 
-def get_user_product_access_level(email: str) -> Dict:
-    """Get user's product access level and permissions"""
-    purchased_products = get_user_purchased_products(email)
-    
-    if not purchased_products:
-        return {"access_level": "none", "products": [], "permissions": []}
-    
-    # Define product-based access levels (customize as needed)
-    access_levels = {
-        "basic": {"min_products": 1, "permissions": ["property_search"]},
-        "premium": {"min_products": 3, "permissions": ["property_search", "analytics", "export"]},
-        "enterprise": {"min_products": 5, "permissions": ["property_search", "analytics", "export", "api_access"]}
-    }
-    
-    product_count = len(purchased_products)
-    total_spent = sum(float(p.get('total', 0)) for p in purchased_products)
-    
-    # Determine access level
-    if product_count >= 5:
-        level = "enterprise"
-    elif product_count >= 3:
-        level = "premium"
-    elif product_count >= 1:
-        level = "basic"
-    else:
-        level = "none"
-    
-    return {
-        "access_level": level,
-        "products": purchased_products,
-        "product_count": product_count,
-        "total_spent": total_spent,
-        "permissions": access_levels.get(level, {}).get("permissions", [])
-    }
+@st.cache_resource(ttl=600, max_entries=128, show_spinner=False)
+def fetch_user_orders(wp_user_id: int) -> Optional[List[Dict]]:
+    """Cached get_wc_customer_orders shared by every orders view (read-only, not copied)"""
+    # Long TTL: order webhooks invalidate this entry (see apply_cache_invalidations)
+    return get_wc_customer_orders(wp_user_id)
+
+def display_orders_analytics(orders: List[Dict]):
+    """Display summary metrics for a list of enriched orders"""
+    if not orders:
+        return
+
+    # Pull each field into a contiguous array once, then reduce in NumPy
+    totals = np.fromiter((o['total_float'] for o in orders), dtype=np.float64, count=len(orders))
+    statuses = np.array([o.get('status') or '' for o in orders])
+    # Naive site-local ISO strings; missing dates become NaT and never count as recent
+    dates = np.array([o.get('date_created') for o in orders], dtype='datetime64[s]')
+
+    completed_count = int((statuses == 'completed').sum())
+    total_value = totals.sum()
+    cutoff = np.datetime64(datetime.datetime.now(), 's') - np.timedelta64(30, 'D')
+    recent_count = int((dates > cutoff).sum())
+
+    col1, col2, col3, col4 = st.columns(4)
+
+    with col1:
+        st.metric("Total Orders", len(orders))
+
+    with col2:
+        st.metric("Completed", completed_count)
+
+    with col3:
+        st.metric("Total Value", f"${total_value:.2f}")
+
+    with col4:
+        st.metric("Last 30 Days", recent_count)
@@ -1,19 +1,10 @@
 import streamlit as st
 import requests
 import datetime
+import hashlib
+import secrets
 from typing import Optional, Dict
-from supabase import create_client, Client
-
-@st.cache_resource
-def init_supabase():
-    """Initialize Supabase client with caching"""
-    try:
-        SUPABASE_URL = st.secrets["supabase"]["url"]
-        SUPABASE_KEY = st.secrets["supabase"]["anon_key"]
-        return create_client(SUPABASE_URL, SUPABASE_KEY)
-    except Exception as e:
-        st.error(f"Failed to initialize Supabase: {e}")
-        return None
+from utils.clients import get_http_session, get_supabase
 
 @st.cache_data(ttl=3600)
 def get_wp_config():
@@ -30,7 +21,7 @@ def get_wp_config():
         st.error(f"WordPress configuration error: {e}")
         return None
 
-supabase = init_supabase()
+supabase = get_supabase()
 wp_config = get_wp_config()
 
 def wp_jwt_login(username: str, password: str) -> Optional[Dict]:
@@ -42,19 +33,19 @@ def wp_jwt_login(username: str, password: str) -> Optional[Dict]:
     url = f"{wp_config['wp_url']}/wp-json/jwt-auth/v1/token"
 
     try:
-        with st.spinner("Authenticating with WordPress..."):
-            resp = requests.post(
-                url,
-                data={"username": username, "password": password},
-                timeout=10
-            )
+        # No spinner here: callers show one status for the whole login
+        resp = get_http_session().post(
+            url,
+            data={"username": username, "password": password},
+            timeout=10
+        )
 
         if resp.status_code == 200:
             token_data = resp.json()
 
             # Fetch user details from WordPress
             me_url = f"{wp_config['wp_url']}/wp-json/wp/v2/users/me"
-            me_resp = requests.get(
+            me_resp = get_http_session().get(
                 me_url,
                 headers={"Authorization": f"Bearer {token_data['token']}"},
                 timeout=10
@@ -105,6 +96,17 @@ def wp_jwt_login(username: str, password: str) -> Optional[Dict]:
         st.error(f"Connection error: {e}")
         return None
 
+def upsert_wp_user_row(row: Dict) -> Optional[Dict]:
+    """Insert or merge a wp_users row matched by email; returns the stored row.
+
+    WordPress and WooCommerce-only logins share one row per email, so None
+    values are dropped rather than overwriting the other path's identity.
+    """
+    payload = {key: value for key, value in row.items() if value is not None}
+    payload["email"] = payload["email"].strip().lower()
+    result = supabase.table("wp_users").upsert(payload, on_conflict="email").execute()
+    return result.data[0] if result.data else None
+
 def sync_wp_user_to_supabase(user_data: Dict) -> bool:
     """Sync WordPress user data to Supabase"""
     if not supabase:
@@ -112,39 +114,20 @@ def sync_wp_user_to_supabase(user_data: Dict) -> bool:
         return False
 
     try:
-        # Check if user exists in Supabase
-        existing_user = supabase.table("wp_users").select("*").eq("wp_user_id", user_data["wp_user_id"]).execute()
-        
-        if existing_user.data:
-            # Update existing user
-            result = supabase.table("wp_users").update({
-                "email": user_data["email"],
-                "username": user_data["username"],
-                "display_name": user_data["display_name"],
-                "last_login": user_data["last_login"],
-                "roles": user_data["roles"],
-                "capabilities": user_data["capabilities"],
-                "wp_token": user_data["wp_token"],
-                "wp_token_expires": user_data["wp_token_expires"]
-            }).eq("wp_user_id", user_data["wp_user_id"]).execute()
-        else:
-            # Insert new user
-            result = supabase.table("wp_users").insert({
-                "wp_user_id": user_data["wp_user_id"],
-                "email": user_data["email"],
-                "username": user_data["username"],
-                "display_name": user_data["display_name"],
-                "last_login": user_data["last_login"],
-                "roles": user_data["roles"],
-                "capabilities": user_data["capabilities"],
-                "wp_token": user_data["wp_token"],
-                "wp_token_expires": user_data["wp_token_expires"],
-                "created_at": user_data["last_login"]
-            }).execute()
-
-        # Initialize usage tracking if new user
-        if not existing_user.data:
-            initialize_user_usage_tracking(user_data["wp_user_id"], user_data["email"])
+        upsert_wp_user_row({
+            "wp_user_id": user_data["wp_user_id"],
+            "email": user_data["email"],
+            "username": user_data["username"],
+            "display_name": user_data["display_name"],
+            "last_login": user_data["last_login"],
+            "roles": user_data["roles"],
+            "capabilities": user_data["capabilities"],
+            "wp_token": user_data["wp_token"],
+            "wp_token_expires": user_data["wp_token_expires"]
+        })
+
+        # Idempotent, so no need to know whether the user is new
+        initialize_user_usage_tracking(user_data["wp_user_id"], user_data["email"])
 
         return True
 
@@ -158,12 +141,13 @@ def initialize_user_usage_tracking(wp_user_id: int, email: str):
         return
 
     try:
-        supabase.table("api_usage").insert({
+        # Create the usage record unless one already exists (ON CONFLICT DO NOTHING)
+        supabase.table("api_usage").upsert({
             "wp_user_id": wp_user_id,
             "email": email,
             "queries": 0,
             "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat()
-        }).execute()
+        }, on_conflict="wp_user_id", ignore_duplicates=True).execute()
     except Exception as e:
         st.warning(f"Failed to initialize usage tracking: {e}")
 
@@ -179,6 +163,59 @@ def get_wp_user_from_supabase(wp_user_id: int) -> Optional[Dict]:
         st.error(f"Failed to get user from Supabase: {e}")
         return None
 
+def _session_key(session_token: str) -> str:
+    """Hash of a session token as stored in user_sessions (the token itself stays client-side)"""
+    return hashlib.sha256(session_token.encode()).hexdigest()
+
+def create_wp_session(wp_user_id: int) -> Optional[str]:
+    """Open a revocable session for a WordPress user and return its opaque token"""
+    if not supabase or not wp_user_id:
+        return None
+
+    session_token = secrets.token_urlsafe(32)
+    try:
+        supabase.table("user_sessions").insert({
+            "session_id": _session_key(session_token),
+            "user_id": wp_user_id,
+            "last_login": datetime.datetime.now(datetime.timezone.utc).isoformat()
+        }).execute()
+        return session_token
+    except Exception as e:
+        st.warning(f"Failed to create session: {e}")
+        return None
+
+def get_wp_user_by_session(session_token: str) -> Optional[Dict]:
+    """Get the Supabase user row behind a live session token"""
+    if not supabase or not session_token:
+        return None
+
+    # Matches the purge_sessions() retention window
+    cutoff = (datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=7)).isoformat()
+    try:
+        session = supabase.table("user_sessions").select("user_id").eq(
+            "session_id", _session_key(session_token)
+        ).gte("last_login", cutoff).execute()
+        if not session.data:
+            return None
+
+        result = supabase.table("wp_users").select(
+            "wp_user_id, wc_customer_id, email, username, display_name, wp_token, purchased_products, product_access"
+        ).eq("wp_user_id", session.data[0]["user_id"]).execute()
+        return result.data[0] if result.data else None
+    except Exception as e:
+        st.error(f"Failed to get user from Supabase: {e}")
+        return None
+
+def revoke_wp_session(session_token: str):
+    """Delete a session so its token can no longer restore a login"""
+    if not supabase or not session_token:
+        return
+
+    try:
+        supabase.table("user_sessions").delete().eq("session_id", _session_key(session_token)).execute()
+    except Exception as e:
+        st.warning(f"Failed to revoke session: {e}")
+
 def validate_wp_token(token: str) -> bool:
     """Validate WordPress JWT token"""
     if not wp_config or not token:
@@ -186,12 +223,12 @@ def validate_wp_token(token: str) -> bool:
 
     try:
         validate_url = f"{wp_config['wp_url']}/wp-json/jwt-auth/v1/token/validate"
-        resp = requests.post(
+        resp = get_http_session().post(
             validate_url,
             headers={"Authorization": f"Bearer {token}"},
             timeout=5
         )
         return resp.status_code == 200
-    except:
+    except requests.exceptions.RequestException:
         return False
 